@@ -1,14 +1,27 @@
 import os
 import json
 import logging
+from contextlib import contextmanager
 from datetime import datetime, date
 from flask import Flask, request, jsonify, send_from_directory
+from sqlalchemy.orm import selectinload
 
-from models import db, Task, Subtask, SubtaskTemplate, Setting, ProcessedEmail, EmailScanLog
+from models import (db, Task, TaskMessage, Subtask, SubtaskTemplate, Setting, ProcessedEmail, EmailScanLog,
+                    ScanJob, make_subject_key, enable_sqlite_savepoints)
 from config import Config, DEFAULT_TEMPLATE
-from email_service import email_service
+from email_service import EmailService, email_service
+from classifier import CLASSIFIER_SETTINGS, invalidate_classifier
 from telegram_service import telegram_service
-from scheduler import init_scheduler, trigger_immediate_scan, update_scan_interval
+from scheduler import init_scheduler, trigger_immediate_scan, effective_interval, is_adaptive, reset_scan_interval
+from scan_jobs import submit_scan_job, submit_reclassify_job, expire_stale_jobs
+from pagination import paginate_tasks, MAX_PAGE_SIZE
+from task_fields import parse_fields, select_fields, fields_dict
+from task_search import init_search_index, search_tasks
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Configure logging
 logging.basicConfig(
@@ -30,13 +43,100 @@ app.config.from_object(Config)
 
 # Initialize database
 db.init_app(app)
+with app.app_context():
+    enable_sqlite_savepoints(db.engine)
+
+
+def ensure_column(table, column, ddl):
+    """Add a column to an existing table, since db.create_all() only creates new tables."""
+    columns = [c['name'] for c in db.inspect(db.engine).get_columns(table)]
+    if column in columns:
+        return False
+    db.session.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    db.session.commit()
+    logger.info(f"Added column {table}.{column}")
+    return True
+
+
+def backfill_subject_keys(chunk_size=1000):
+    """Fill Task.subject_key for rows created before the column existed."""
+    filled = 0
+    while True:
+        tasks = Task.query.filter(Task.subject_key.is_(None), Task.title.isnot(None)).limit(chunk_size).all()
+        if not tasks:
+            break
+        for task in tasks:
+            task.subject_key = make_subject_key(task.title)
+        db.session.commit()
+        filled += len(tasks)
+    if filled:
+        logger.info(f"Backfilled subject keys for {filled} tasks")
+
+
+@contextmanager
+def init_lock():
+    """Keep processes starting together (web workers, the scanner) from running init_db at once.
+
+    On SQLite this is a lock file next to the database, which only works
+    when the processes share that directory; on Postgres an advisory lock.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(db.text('SELECT pg_advisory_lock(:key)'), {'key': 7421})
+            try:
+                yield
+            finally:
+                conn.execute(db.text('SELECT pg_advisory_unlock(:key)'), {'key': 7421})
+                conn.commit()
+        return
+
+    database = db.engine.url.database
+    if db.engine.dialect.name != 'sqlite' or fcntl is None or not database or database == ':memory:':
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+    with open(f'{database}.init-lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
 
 def init_db():
     """Initialize database and create default template."""
-    with app.app_context():
+    with app.app_context(), init_lock():
         db.create_all()
 
+        # Schema upgrades for databases created by older versions
+        ensure_column('tasks', 'subject_key', 'VARCHAR(500)')
+        ensure_column('mailbox_states', 'resume_search', 'VARCHAR(200)')
+        ensure_column('mailbox_states', 'resume_uid', 'BIGINT')
+        ensure_column('mailbox_states', 'newest_uid', 'BIGINT')
+        ensure_column('mailbox_states', 'newest_uidvalidity', 'BIGINT')
+        ensure_column('mailbox_states', 'failed_attempts', 'TEXT')
+        ensure_column('scan_jobs', 'kind', "VARCHAR(20) DEFAULT 'scan'")
+        ensure_column('scan_jobs', 'holder', 'VARCHAR(200)')
+        db.session.execute(db.text('CREATE INDEX IF NOT EXISTS ix_tasks_subject_key ON tasks (subject_key)'))
+        db.session.execute(db.text(
+            'CREATE INDEX IF NOT EXISTS ix_tasks_board_order ON tasks (due_date, created_at DESC, id DESC)'))
+        db.session.execute(db.text('CREATE INDEX IF NOT EXISTS ix_subtasks_task_id ON subtasks (task_id)'))
+        db.session.execute(db.text(
+            'CREATE INDEX IF NOT EXISTS ix_email_scan_logs_message_id ON email_scan_logs (message_id)'))
+        db.session.commit()
+        backfill_subject_keys()
+        init_search_index()
+
+        # Seed the thread index with the source email of existing tasks
+        if TaskMessage.query.first() is None:
+            db.session.execute(db.text(
+                "INSERT INTO task_messages (message_id, task_id, created_at) "
+                "SELECT TRIM(source_email_id), MIN(id), CURRENT_TIMESTAMP FROM tasks "
+                "WHERE source_email_id IS NOT NULL AND TRIM(source_email_id) != '' "
+                "GROUP BY TRIM(source_email_id)"
+            ))
+            db.session.commit()
+
         # Create default template if none exists
         if SubtaskTemplate.query.count() == 0:
             template = SubtaskTemplate(
@@ -51,39 +151,70 @@ def init_db():
 # Initialize database on startup (works with gunicorn)
 init_db()
 
-# Initialize scheduler for automatic email scanning (works with gunicorn)
-init_scheduler(app)
+# Initialize scheduler for automatic email scanning (works with gunicorn).
+# Disabled when scans run in their own process, see scanner.py
+if Config.SCHEDULER_ENABLED:
+    init_scheduler(app)
 
 
 # ============== TASK ENDPOINTS ==============
 
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    """Get all tasks with optional filtering."""
+    """Get tasks with optional filtering.
+
+    Without a limit all matching tasks are returned as a list. With
+    ?limit=N the response is one page, {"tasks": [...], "next_cursor": ...};
+    pass next_cursor back as ?cursor= for the following page. ?fields=
+    limits each task to the listed fields, ?fields=summary to the ones the
+    board needs, with subtask progress counts instead of the subtasks.
+    ?search= matches word prefixes through the full-text index; add
+    ?sort=relevance for the best matches first (up to limit, no cursor).
+    """
     status = request.args.get('status')
     priority = request.args.get('priority')
     search = request.args.get('search')
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    sort = request.args.get('sort')
 
     query = Task.query
+    rank = None
 
     if status:
         query = query.filter(Task.status == status)
     if priority:
         query = query.filter(Task.priority == priority)
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            db.or_(
-                Task.title.ilike(search_term),
-                Task.customer_name.ilike(search_term),
-                Task.company.ilike(search_term),
-                Task.po_number.ilike(search_term),
-                Task.so_number.ilike(search_term)
-            )
-        )
+        query, rank = search_tasks(query, search)
+
+    if request.args.get('fields'):
+        try:
+            fields = parse_fields(request.args['fields'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = select_fields(query, fields)
+        serialize = lambda row: fields_dict(row, fields)
+    else:
+        # Load the subtasks of the whole page in one query instead of one per task
+        query = query.options(selectinload(Task.subtasks))
+        serialize = Task.to_dict
+
+    if sort == 'relevance' and rank is not None:
+        limit = MAX_PAGE_SIZE if limit is None else max(1, min(limit, MAX_PAGE_SIZE))
+        tasks = query.order_by(rank, Task.id.desc()).limit(limit).all()
+        return jsonify([serialize(t) for t in tasks])
 
-    tasks = query.order_by(Task.due_date.asc().nullslast(), Task.created_at.desc()).all()
-    return jsonify([t.to_dict() for t in tasks])
+    if limit is None and not cursor:
+        tasks = query.order_by(Task.due_date.asc().nullslast(), Task.created_at.desc(), Task.id.desc()).all()
+        return jsonify([serialize(t) for t in tasks])
+
+    limit = MAX_PAGE_SIZE if limit is None else max(1, min(limit, MAX_PAGE_SIZE))
+    try:
+        tasks, next_cursor = paginate_tasks(query, limit, cursor)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'tasks': [serialize(t) for t in tasks], 'next_cursor': next_cursor})
 
 
 @app.route('/api/tasks/<int:task_id>', methods=['GET'])
@@ -215,6 +346,7 @@ def bulk_delete_tasks():
     if not task_ids:
         return jsonify({'message': 'No tasks specified', 'deleted': 0})
 
+    TaskMessage.query.filter(TaskMessage.task_id.in_(task_ids)).delete(synchronize_session=False)
     deleted = Task.query.filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
     db.session.commit()
 
@@ -225,6 +357,7 @@ def bulk_delete_tasks():
 def delete_all_tasks():
     """Delete all tasks. Use with caution!"""
     # Also clear processed emails so rescanning can recreate tasks
+    TaskMessage.query.delete()
     deleted_tasks = Task.query.delete()
     deleted_emails = ProcessedEmail.query.delete()
     EmailScanLog.query.delete()
@@ -240,7 +373,7 @@ def delete_all_tasks():
 @app.route('/api/tasks/<int:task_id>/apply-template', methods=['POST'])
 def apply_template(task_id):
     """Apply a subtask template to a task."""
-    task = Task.query.get_or_404(task_id)
+    task = Task.query.options(selectinload(Task.subtasks)).filter_by(id=task_id).first_or_404()
     data = request.json
     template_id = data.get('template_id')
 
@@ -252,19 +385,15 @@ def apply_template(task_id):
         steps = DEFAULT_TEMPLATE['steps']
 
     # Get current max sort order
-    max_order = db.session.query(db.func.max(Subtask.sort_order)).filter(
-        Subtask.task_id == task_id
-    ).scalar() or 0
+    max_order = max((s.sort_order or 0 for s in task.subtasks), default=0)
 
     # Add subtasks from template
     for i, step in enumerate(steps):
-        subtask = Subtask(
-            task_id=task_id,
+        task.subtasks.append(Subtask(
             title=step,
             status='pending',
             sort_order=max_order + i + 1
-        )
-        db.session.add(subtask)
+        ))
 
     db.session.commit()
     return jsonify(task.to_dict())
@@ -376,12 +505,23 @@ def delete_template(template_id):
 
 @app.route('/api/email/scan-now', methods=['POST'])
 def scan_now():
-    """Trigger immediate email scan."""
+    """Start an email scan in the background and return its job for polling."""
     data = request.json or {}
     scan_all = data.get('scan_all', False)
     days = data.get('days', None)
-    result = email_service.scan_inbox(scan_all=scan_all, days=days)
-    return jsonify(result)
+    incremental = data.get('incremental', False)
+    job, coalesced = submit_scan_job(app, scan_all=scan_all, days=days, incremental=incremental)
+    return jsonify({**job.to_dict(), 'job_id': job.id, 'coalesced': coalesced}), 202
+
+
+@app.route('/api/email/scan-jobs/<int:job_id>', methods=['GET'])
+def get_scan_job(job_id):
+    """Get the status and progress of a scan job."""
+    # Jobs of a runner that died are failed here too, so polling clients see it
+    expire_stale_jobs()
+    db.session.commit()
+    job = ScanJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
 
 
 @app.route('/api/email/status', methods=['GET'])
@@ -393,7 +533,9 @@ def email_status():
     return jsonify({
         'configured': is_configured,
         'server': config['server'] if is_configured else None,
-        'email': config['email'] if is_configured else None
+        'email': config['email'] if is_configured else None,
+        'scan_interval_minutes': effective_interval(),
+        'scan_interval_adaptive': is_adaptive()
     })
 
 
@@ -437,9 +579,24 @@ def update_trigger_words():
     if 'marketing_filters' in data:
         Setting.set('marketing_filters', json.dumps(data['marketing_filters']))
 
+    # Rebuild the compiled matcher in every process
+    invalidate_classifier()
+
     return jsonify({'message': 'Trigger words updated'})
 
 
+@app.route('/api/email/reclassify', methods=['POST'])
+def reclassify_emails():
+    """Re-run the current filters over skipped emails in the message cache, in the background.
+
+    The job's result reports what would change; with apply set, the tasks
+    are created. Poll it like a scan job.
+    """
+    data = request.json or {}
+    job, coalesced = submit_reclassify_job(app, apply=data.get('apply', False))
+    return jsonify({**job.to_dict(), 'job_id': job.id, 'coalesced': coalesced}), 202
+
+
 # ============== SETTINGS ENDPOINTS ==============
 
 @app.route('/api/settings', methods=['GET'])
@@ -451,6 +608,9 @@ def get_settings():
     # Add defaults for missing settings
     defaults = {
         'scan_interval_minutes': str(Config.SCAN_INTERVAL_MINUTES),
+        'scan_interval_adaptive': str(Config.SCAN_INTERVAL_ADAPTIVE).lower(),
+        'scan_interval_min_minutes': f'{Config.SCAN_INTERVAL_MIN_MINUTES:g}',
+        'scan_interval_max_minutes': f'{Config.SCAN_INTERVAL_MAX_MINUTES:g}',
         'default_due_days': str(Config.DEFAULT_DUE_DAYS),
         'theme': 'dark'
     }
@@ -479,19 +639,25 @@ def update_settings():
         Setting.set(key, value)
 
     # Update scan interval if changed
-    if 'scan_interval_minutes' in data:
+    interval_keys = ('scan_interval_minutes', 'scan_interval_adaptive', 'scan_interval_min_minutes',
+                     'scan_interval_max_minutes')
+    if any(key in data for key in interval_keys):
         try:
-            update_scan_interval(int(data['scan_interval_minutes']))
+            reset_scan_interval()
         except Exception as e:
             logger.error(f"Failed to update scan interval: {e}")
 
+    # Rebuild the compiled matcher in every process
+    if any(key in data for key in CLASSIFIER_SETTINGS):
+        invalidate_classifier()
+
     return jsonify({'message': 'Settings updated'})
 
 
 @app.route('/api/settings/test-imap', methods=['POST'])
 def test_imap():
     """Test IMAP connection."""
-    result = email_service.test_connection()
+    result = EmailService(app).test_connection()
     return jsonify(result)
 
 
@@ -509,21 +675,17 @@ def get_stats():
     """Get dashboard statistics."""
     today = date.today()
 
-    total = Task.query.count()
-    completed = Task.query.filter(Task.status == 'completed').count()
-    in_progress = Task.query.filter(Task.status == 'in_progress').count()
-    overdue = Task.query.filter(
-        Task.due_date < today,
-        Task.status != 'completed'
-    ).count()
-    due_today = Task.query.filter(
-        Task.due_date == today,
-        Task.status != 'completed'
-    ).count()
-    high_priority = Task.query.filter(
-        Task.priority == 'high',
-        Task.status != 'completed'
-    ).count()
+    open_task = Task.status != 'completed'
+
+    # All counts in a single pass over the tasks table
+    total, completed, in_progress, overdue, due_today, high_priority = db.session.query(
+        db.func.count(Task.id),
+        db.func.count(db.case((Task.status == 'completed', 1))),
+        db.func.count(db.case((Task.status == 'in_progress', 1))),
+        db.func.count(db.case((db.and_(Task.due_date < today, open_task), 1))),
+        db.func.count(db.case((db.and_(Task.due_date == today, open_task), 1))),
+        db.func.count(db.case((db.and_(Task.priority == 'high', open_task), 1)))
+    ).one()
 
     return jsonify({
         'total': total,
@@ -566,7 +728,6 @@ def not_found(e):
 
 if __name__ == '__main__':
     init_db()
-    init_scheduler(app)
 
     # Use production mode for less RAM usage (set DEBUG=true env var to enable debug)
     debug_mode = os.environ.get('DEBUG', 'false').lower() == 'true'
@@ -0,0 +1,163 @@
+"""Micro-benchmark: reference number extraction, legacy loop vs precompiled extractor.
+
+Run from the backend directory:
+
+    python benchmarks/bench_reference_numbers.py [--emails 2000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from references import ReferenceExtractor  # noqa: E402
+
+GREETINGS = ['Hi team,', 'Hello,', 'Good morning,', 'Hi Sarah,', 'Dear Sales,']
+SENTENCES = [
+    'Please see the attached drawings for the bracket assembly.',
+    'We need these parts delivered to our plant by the end of the month.',
+    'Let me know if you have any questions about the tolerances.',
+    'Our receiving dock is open from 7am to 3pm, Monday to Friday.',
+    'The finish should match the samples we sent last quarter.',
+    'Also, 3 of the previous units arrived with scratches on the housing.',
+    'Could you confirm lead time and freight cost for this order?',
+    'We are planning the Q3 production run and want to lock in pricing.',
+    'Thanks again for the quick turnaround on the last job.',
+    'Send the invoice to accounts payable, PO Box 4410, Springfield.',
+]
+REFERENCES = [
+    'PO# {n}', 'PO {n}-A', 'Purchase Order: {n}', 'SO-{n}', 'Sales Order {n}',
+    'Quote #{n}', 'RFQ {n}', 'Q-{n}',
+]
+SIGNATURE = '\n\nBest regards,\nJohn Miller\nPurchasing Manager\nAcme Industrial Supply\nPhone: 555-201-{n}\n'
+QUOTED = '\n\n-----Original Message-----\nFrom: sales@example.com\nSubject: RE: order status\n\n'
+
+
+LEGACY_PATTERNS = {
+    'po_number': [
+        r'PO[#:\s-]*(\d+[-\w]*)',
+        r'Purchase Order[#:\s-]*(\d+[-\w]*)',
+    ],
+    'so_number': [
+        r'SO[#:\s-]*(\d+[-\w]*)',
+        r'Sales Order[#:\s-]*(\d+[-\w]*)',
+    ],
+    'quote_number': [
+        r'Quote[#:\s-]*(\d+[-\w]*)',
+        r'Q[#:\s-]*(\d+[-\w]*)',
+        r'RFQ[#:\s-]*(\d+[-\w]*)',
+    ]
+}
+
+
+def legacy_extract_reference_numbers(subject, body):
+    """The extractor before the precompiled engine, kept for comparison."""
+    text = f"{subject} {body}"
+    patterns = LEGACY_PATTERNS
+    result = {}
+    for field, pats in patterns.items():
+        for pat in pats:
+            match = re.search(pat, text, re.IGNORECASE)
+            if match:
+                result[field] = match.group(1)
+                break
+    return result
+
+
+def build_corpus(count, seed=42):
+    """Generate (subject, body) pairs shaped like customer order emails."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        refs = [rng.choice(REFERENCES).format(n=rng.randint(1000, 999999)) for _ in range(rng.randint(0, 2))]
+        subject = rng.choice(['RE: ', 'FW: ', '']) + rng.choice(['Order request', 'Quote needed', 'Delivery update'])
+        if refs and rng.random() < 0.5:
+            subject += ' - ' + refs.pop()
+        paragraphs = [rng.choice(GREETINGS)]
+        for _ in range(rng.randint(3, 15)):
+            paragraphs.append(' '.join(rng.choice(SENTENCES) for _ in range(rng.randint(1, 4))))
+        for ref in refs:
+            paragraphs.insert(rng.randint(1, len(paragraphs)), f'Reference: {ref}.')
+        body = '\n\n'.join(paragraphs) + SIGNATURE.format(n=rng.randint(1000, 9999))
+        if rng.random() < 0.4:
+            body += QUOTED + body
+        corpus.append((subject, body))
+    return corpus
+
+
+def classify_differences(corpus, extractor):
+    """Count, per field, how the legacy and precompiled results differ.
+
+    order: each picked a number the other also finds for the field, so
+    only which one comes first differs (the legacy loop tries its patterns
+    one after another, the extractor takes the first occurrence in the
+    text).
+    false_positive: the legacy number is not behind a label the extractor
+    accepts ('also 3', 'Q3', 'PO Box 4410').
+    other: anything else, e.g. a number only the extractor finds.
+    """
+    counts = {field: {'order': 0, 'false_positive': 0, 'other': 0} for field in LEGACY_PATTERNS}
+    emails = 0
+    for subject, body in corpus:
+        text = f"{subject} {body}"
+        legacy = legacy_extract_reference_numbers(subject, body)
+        current = extractor.extract(subject, body)
+        if legacy == current:
+            continue
+        emails += 1
+        for field in LEGACY_PATTERNS:
+            if legacy.get(field) == current.get(field):
+                continue
+            legacy_numbers = {n for p in LEGACY_PATTERNS[field] for n in re.findall(p, text, re.IGNORECASE)}
+            current_numbers = {m.group('number') for m in extractor.pattern.finditer(text) if m.group(field)}
+            if legacy.get(field) in current_numbers and current.get(field) in legacy_numbers:
+                counts[field]['order'] += 1
+            elif legacy.get(field) and legacy[field] not in current_numbers:
+                counts[field]['false_positive'] += 1
+            else:
+                counts[field]['other'] += 1
+    return emails, counts
+
+
+def bench(func, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for subject, body in corpus:
+            func(subject, body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--emails', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.emails)
+    size = sum(len(s) + len(b) for s, b in corpus)
+    extractor = ReferenceExtractor()
+
+    legacy = bench(legacy_extract_reference_numbers, corpus, args.repeat)
+    compiled = bench(extractor.extract, corpus, args.repeat)
+
+    differing, differences = classify_differences(corpus, extractor)
+
+    print(f"corpus: {len(corpus)} emails, {size / 1024:.0f} KiB")
+    for name, elapsed in (('legacy', legacy), ('precompiled', compiled)):
+        print(f"{name:>12}: {elapsed * 1000:8.1f} ms  {len(corpus) / elapsed:10.0f} emails/s  "
+              f"{size / elapsed / 1024 / 1024:6.1f} MiB/s")
+    print(f"     speedup: {legacy / compiled:.1f}x")
+    print(f"   differing: {differing} emails")
+    for field, counts in differences.items():
+        print(f"{field:>14}: {counts['false_positive']:5} legacy false positives, "
+              f"{counts['order']:5} first-occurrence order, {counts['other']:5} other")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import json
+import re
+import threading
+
+from models import Setting
+from config import Config, TRIGGER_WORDS, MARKETING_FILTERS
+
+# Words that bump an email-created task to high priority
+HIGH_PRIORITY_WORDS = ['urgent', 'asap', 'immediately', 'critical', 'emergency', 'rush']
+
+# Settings the compiled classifier is built from
+CLASSIFIER_SETTINGS = ('trigger_words', 'marketing_filters', 'match_whole_words')
+
+
+def get_trigger_words():
+    """Get trigger words from settings or use defaults."""
+    custom = Setting.get('trigger_words')
+    if custom:
+        try:
+            return json.loads(custom)
+        except:
+            pass
+    return TRIGGER_WORDS
+
+
+def get_marketing_filters():
+    """Get marketing filters from settings or use defaults."""
+    custom = Setting.get('marketing_filters')
+    if custom:
+        try:
+            return json.loads(custom)
+        except:
+            pass
+    return MARKETING_FILTERS
+
+
+def build_trie_pattern(words):
+    """Build a regex matching the longest of `words` at a position, structured as a trie.
+
+    A flat "a|b|c" alternation makes the regex engine try every word at
+    every position; the trie form rejects most positions on the first char.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+class Classifier:
+    """Compiled trigger/marketing/priority matcher that classifies an email in one pass.
+
+    Keeps the semantics of the old per-word loops: the reported trigger is
+    the first matching word in TRIGGER_WORDS order and the reported filter
+    the first matching one in MARKETING_FILTERS order, wherever in the text
+    they occur. Matching is substring-based unless whole_words is set.
+    """
+
+    def __init__(self, trigger_words, marketing_filters, priority_words=HIGH_PRIORITY_WORDS, whole_words=False):
+        self.whole_words = whole_words
+        self.terms = {}  # lowercased term -> {'trigger': (rank, category, word), 'marketing': (rank, word), ...}
+
+        rank = 0
+        for category, words in trigger_words.items():
+            for word in words:
+                if word:
+                    self.terms.setdefault(word.lower(), {}).setdefault('trigger', (rank, category, word))
+                    rank += 1
+        for rank, word in enumerate(marketing_filters):
+            if word:
+                self.terms.setdefault(word.lower(), {}).setdefault('marketing', (rank, word))
+        for word in priority_words:
+            self.terms.setdefault(word.lower(), {})['priority'] = True
+
+        # The regex reports only the longest term starting at each position, so
+        # remember which shorter terms are prefixes of it
+        self.prefixes = {term: [t for t in self.terms if term.startswith(t)] for term in self.terms}
+
+        self.pattern = re.compile(build_trie_pattern(self.terms)) if self.terms else None
+
+    def _is_word(self, text, start, end):
+        return (start == 0 or not text[start - 1].isalnum() and text[start - 1] != '_') and \
+               (end >= len(text) or not text[end].isalnum() and text[end] != '_')
+
+    def _terms_at(self, text, match):
+        start = match.start()
+        for term in self.prefixes[match.group()]:
+            if not self.whole_words or self._is_word(text, start, start + len(term)):
+                yield term
+
+    def find_terms(self, text):
+        """Yield every term occurring in the (lowercased) text."""
+        if not self.pattern:
+            return
+        for match in self.pattern.finditer(text):
+            yield from self._terms_at(text, match)
+            # finditer resumes after the match, so look for terms starting inside it
+            for pos in range(match.start() + 1, match.end()):
+                inner = self.pattern.match(text, pos)
+                if inner:
+                    yield from self._terms_at(text, inner)
+
+    def classify(self, subject, body, from_addr=''):
+        """Classify an email. Returns (marketing_word, category, trigger_word, priority)."""
+        trigger = None
+        marketing = None
+        priority = 'medium'
+
+        for text, check_triggers in ((f"{subject} {body}".lower(), True), (from_addr.lower(), False)):
+            for term in self.find_terms(text):
+                info = self.terms[term]
+                if check_triggers and 'trigger' in info and (trigger is None or info['trigger'] < trigger):
+                    trigger = info['trigger']
+                if 'marketing' in info and (marketing is None or info['marketing'] < marketing):
+                    marketing = info['marketing']
+                if check_triggers and info.get('priority'):
+                    priority = 'high'
+
+        return (
+            marketing[1] if marketing else None,
+            trigger[1] if trigger else None,
+            trigger[2] if trigger else None,
+            priority
+        )
+
+
+_cache = {'version': None, 'classifier': None}
+_cache_lock = threading.Lock()
+
+
+def get_classifier():
+    """Get the compiled classifier, rebuilding it when the settings version changes."""
+    version = Setting.get('classifier_version') or '0'
+    with _cache_lock:
+        if _cache['classifier'] is None or _cache['version'] != version:
+            whole_words = (Setting.get('match_whole_words') or str(Config.MATCH_WHOLE_WORDS)).lower() == 'true'
+            _cache['classifier'] = Classifier(get_trigger_words(), get_marketing_filters(), whole_words=whole_words)
+            _cache['version'] = version
+        return _cache['classifier']
+
+
+def invalidate_classifier():
+    """Bump the settings version so every process rebuilds its classifier."""
+    version = int(Setting.get('classifier_version') or 0) + 1
+    Setting.set('classifier_version', str(version))
+    with _cache_lock:
+        _cache['classifier'] = None
@@ -28,6 +28,56 @@ class Config:
     # Scanning
     SCAN_INTERVAL_MINUTES = int(os.getenv('SCAN_INTERVAL_MINUTES', 5))
     DEFAULT_DUE_DAYS = int(os.getenv('DEFAULT_DUE_DAYS', 3))
+    # Adaptive mode halves the interval after a scan that found new mail and doubles
+    # it after an empty or failed one, staying within the min/max bounds
+    SCAN_INTERVAL_ADAPTIVE = os.getenv('SCAN_INTERVAL_ADAPTIVE', 'false').lower() == 'true'
+    SCAN_INTERVAL_MIN_MINUTES = float(os.getenv('SCAN_INTERVAL_MIN_MINUTES', 1))
+    SCAN_INTERVAL_MAX_MINUTES = float(os.getenv('SCAN_INTERVAL_MAX_MINUTES', 60))
+    # Only fetch UIDs above the last-seen high-water mark on scheduled scans
+    INCREMENTAL_SCAN = os.getenv('INCREMENTAL_SCAN', 'true').lower() == 'true'
+    # Number of UIDs requested per IMAP FETCH round-trip
+    FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', 100))
+    # Byte cap when fetching the text part of a message
+    BODY_FETCH_MAX_BYTES = int(os.getenv('BODY_FETCH_MAX_BYTES', 65536))
+    # Write a skipped_duplicate row to email_scan_logs for every already processed email
+    LOG_SKIPPED_DUPLICATES = os.getenv('LOG_SKIPPED_DUPLICATES', 'true').lower() == 'true'
+    # Commit scan writes every N emails or every N milliseconds, whichever comes first
+    SCAN_COMMIT_EVERY = int(os.getenv('SCAN_COMMIT_EVERY', 50))
+    SCAN_COMMIT_INTERVAL_MS = int(os.getenv('SCAN_COMMIT_INTERVAL_MS', 1000))
+    # Match trigger words and marketing filters as whole words instead of substrings
+    MATCH_WHOLE_WORDS = os.getenv('MATCH_WHOLE_WORDS', 'false').lower() == 'true'
+    # Stop a scan after this many seconds or fetched messages (0 = no limit); the
+    # next scan of the folder resumes from its checkpoint
+    SCAN_TIME_BUDGET_SECONDS = int(os.getenv('SCAN_TIME_BUDGET_SECONDS', 0))
+    SCAN_MESSAGE_BUDGET = int(os.getenv('SCAN_MESSAGE_BUDGET', 0))
+    # Skip an email that failed this many scans in a row so the checkpoint can move past it (0 = never)
+    SCAN_MAX_ATTEMPTS = int(os.getenv('SCAN_MAX_ATTEMPTS', 3))
+    # Keep fetched headers and body text in the database so rescans skip IMAP;
+    # least recently used entries are evicted past the size or age limit
+    MESSAGE_CACHE_ENABLED = os.getenv('MESSAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    MESSAGE_CACHE_MAX_MB = int(os.getenv('MESSAGE_CACHE_MAX_MB', 200))
+    MESSAGE_CACHE_MAX_AGE_DAYS = int(os.getenv('MESSAGE_CACHE_MAX_AGE_DAYS', 30))
+    # Decode and classify bodies in a process pool when a scan has this many messages
+    PARSE_POOL_MIN_MESSAGES = int(os.getenv('PARSE_POOL_MIN_MESSAGES', 500))
+    # Worker processes for that pool; 0 means one per CPU, 1 disables it
+    PARSE_POOL_WORKERS = int(os.getenv('PARSE_POOL_WORKERS', 0))
+    # JSON list of accounts and folders to scan, e.g.
+    # [{"folders": ["INBOX", "Quotes"]}, {"email": "orders@example.com", "password": "..."}]
+    MAILBOXES = os.getenv('MAILBOXES', '')
+    # Mailboxes scanned in parallel, each over its own IMAP connection
+    MAILBOX_SCAN_WORKERS = int(os.getenv('MAILBOX_SCAN_WORKERS', 4))
+
+    # Start the scan scheduler in the web process; turn off when `python -m scanner` runs separately
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    # Seconds a process holds the scheduler lease without renewing it; another
+    # worker takes over scheduled scans once it lapses
+    SCHEDULER_LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', 30))
+
+    # Push mode: hold an IMAP IDLE session and scan as soon as mail arrives
+    IMAP_IDLE_ENABLED = os.getenv('IMAP_IDLE_ENABLED', 'false').lower() == 'true'
+    # RFC 2177 servers may drop IDLE after 30 minutes, so re-issue it before that
+    IMAP_IDLE_REFRESH_MINUTES = int(os.getenv('IMAP_IDLE_REFRESH_MINUTES', 29))
+    IMAP_IDLE_MAX_BACKOFF_SECONDS = int(os.getenv('IMAP_IDLE_MAX_BACKOFF_SECONDS', 300))
 
 
 # Trigger words for email classification
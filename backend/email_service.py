@@ -1,68 +1,63 @@
 import imaplib
-import email
+import json
 from email.header import decode_header
-from email.utils import parseaddr, parsedate_to_datetime
+from email.utils import parseaddr
 from datetime import datetime, timedelta
 import re
-import json
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from models import db, Task, ProcessedEmail, Setting, EmailScanLog
-from config import Config, TRIGGER_WORDS, MARKETING_FILTERS
+from models import db, Task, TaskMessage, ProcessedEmail, Setting, MailboxState
+from config import Config
+from classifier import get_classifier
+from references import get_reference_extractor
+from parse_pool import ParsePool
+from scan_pipeline import ScanPipeline
+from message_cache import MessageCache, evict_messages
+from mail_parser import quote_mailbox, join_fetch_response, parse_fetch_items, find_text_part, message_body
 
 logger = logging.getLogger(__name__)
 
+# Matches the UID data item in an untagged FETCH response line
+FETCH_UID_RE = re.compile(rb'UID (\d+)')
 
-def get_trigger_words():
-    """Get trigger words from settings or use defaults."""
-    custom = Setting.get('trigger_words')
-    if custom:
-        try:
-            return json.loads(custom)
-        except:
-            pass
-    return TRIGGER_WORDS
-
-
-def get_marketing_filters():
-    """Get marketing filters from settings or use defaults."""
-    custom = Setting.get('marketing_filters')
-    if custom:
-        try:
-            return json.loads(custom)
-        except:
-            pass
-    return MARKETING_FILTERS
-
+# Phase one of a scan only downloads the headers needed for dedup and filtering
+HEADER_FIELDS = 'MESSAGE-ID SUBJECT FROM DATE IN-REPLY-TO REFERENCES LIST-UNSUBSCRIBE PRECEDENCE'
+HEADER_FETCH_ITEMS = f'(BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])'
+BODY_FETCH_ITEMS = '(BODY.PEEK[])'
 
-def normalize_subject(subject):
-    """Strip Re:, Fwd:, etc. prefixes to get the base subject for thread grouping."""
-    if not subject:
-        return ''
+# Message-IDs listed in In-Reply-To / References headers
+MESSAGE_ID_RE = re.compile(r'<[^<>\s]+>')
 
-    # Pattern to match common reply/forward prefixes (case-insensitive)
-    # Handles: Re:, RE:, Fwd:, FW:, Fw:, and multiple prefixes like "Re: Re: Re:"
-    pattern = r'^(?:\s*(?:re|fwd?|fw)\s*:\s*)+'
-    normalized = re.sub(pattern, '', subject, flags=re.IGNORECASE).strip()
-    return normalized
+# Precedence values used by bulk mailers and mailing lists
+BULK_PRECEDENCE = ('bulk', 'list', 'junk')
 
 
 class EmailService:
     """Service for scanning emails and creating tasks."""
 
-    def __init__(self, app=None):
+    def __init__(self, app=None, account=None):
         self.app = app
+        self.account = account or {}  # Overrides of the primary IMAP settings
         self.connection = None
 
     def get_config(self):
         """Get IMAP config from settings or environment."""
-        return {
+        config = {
             'server': Setting.get('imap_server') or Config.IMAP_SERVER,
             'port': int(Setting.get('imap_port') or Config.IMAP_PORT),
             'email': Setting.get('imap_email') or Config.IMAP_EMAIL,
             'password': Setting.get('imap_password') or Config.IMAP_PASSWORD,
             'use_ssl': (Setting.get('imap_use_ssl') or str(Config.IMAP_USE_SSL)).lower() == 'true'
         }
+        for key in config:
+            if self.account.get(key) not in (None, ''):
+                config[key] = self.account[key]
+        config['port'] = int(config['port'])
+        if isinstance(config['use_ssl'], str):
+            config['use_ssl'] = config['use_ssl'].lower() == 'true'
+        return config
 
     def connect(self):
         """Establish IMAP connection."""
@@ -120,41 +115,56 @@ class EmailService:
         return ' '.join(result)
 
     def get_email_body(self, msg):
-        """Extract plain text body from email."""
-        body = ''
-
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if content_type == 'text/plain':
-                    try:
-                        payload = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or 'utf-8'
-                        body = payload.decode(charset, errors='replace')
-                        break
-                    except:
-                        pass
-        else:
-            try:
-                payload = msg.get_payload(decode=True)
-                charset = msg.get_content_charset() or 'utf-8'
-                body = payload.decode(charset, errors='replace')
-            except:
-                pass
-
-        return body
+        """Extract plain text body from email, falling back to the HTML part."""
+        return message_body(msg)
 
     def is_marketing_email(self, subject, body, from_addr):
         """Check if email is marketing/spam to ignore."""
-        text = f"{subject} {body} {from_addr}".lower()
-        filters = get_marketing_filters()
+        return get_classifier().classify(subject, body, from_addr)[0]
 
-        for filter_word in filters:
-            if filter_word.lower() in text:
-                return filter_word
+    def is_marketing_header(self, msg, subject, from_header, classifier=None):
+        """Check headers alone for marketing mail. Returns the reason, or None."""
+        if msg.get('List-Unsubscribe'):
+            return 'Marketing header: List-Unsubscribe'
+
+        precedence = (msg.get('Precedence') or '').strip().lower()
+        if precedence in BULK_PRECEDENCE:
+            return f'Marketing header: Precedence {precedence}'
+
+        marketing_word = (classifier or get_classifier()).classify(subject, '', from_header)[0]
+        if marketing_word:
+            return f'Marketing filter: "{marketing_word}"'
 
         return None
 
+    def find_processed_ids(self, message_ids, chunk_size=500):
+        """Return which of the given Message-IDs are already in processed_emails."""
+        message_ids = list(set(message_ids))
+        found = set()
+        for start in range(0, len(message_ids), chunk_size):
+            rows = db.session.query(ProcessedEmail.message_id).filter(
+                ProcessedEmail.message_id.in_(message_ids[start:start + chunk_size])
+            ).all()
+            found.update(row[0] for row in rows)
+        return found
+
+    def find_thread_by_headers(self, msg):
+        """Resolve a reply to its task through In-Reply-To/References. Returns the task ID or None."""
+        refs = MESSAGE_ID_RE.findall(f"{msg.get('In-Reply-To') or ''} {msg.get('References') or ''}")
+        if not refs:
+            return None
+
+        row = db.session.query(TaskMessage.task_id).join(Task, Task.id == TaskMessage.task_id).filter(
+            TaskMessage.message_id.in_(refs)
+        ).first()
+        return row[0] if row else None
+
+    def record_thread_message(self, message_id, task_id):
+        """Remember which task an email belongs to, for header-based threading."""
+        message_id = (message_id or '').strip()
+        if message_id:
+            db.session.add(TaskMessage(message_id=message_id, task_id=task_id))
+
     def extract_customer_info(self, from_header, body):
         """Extract customer name, email, and company from email."""
         name, email_addr = parseaddr(from_header)
@@ -176,274 +186,409 @@ class EmailService:
 
     def detect_trigger_category(self, subject, body):
         """Detect which trigger category matches the email."""
-        text = f"{subject} {body}".lower()
-        trigger_words = get_trigger_words()
-
-        for category, words in trigger_words.items():
-            for word in words:
-                if word.lower() in text:
-                    return category, word
+        _, category, word, _ = get_classifier().classify(subject, body)
+        return category, word
 
-        return None, None
-
-    def extract_reference_numbers(self, subject, body):
+    def extract_reference_numbers(self, subject, body, from_email=None):
         """Extract PO, SO, and quote numbers from email."""
-        text = f"{subject} {body}"
-
-        # Patterns for reference numbers
-        patterns = {
-            'po_number': [
-                r'PO[#:\s-]*(\d+[-\w]*)',
-                r'Purchase Order[#:\s-]*(\d+[-\w]*)',
-            ],
-            'so_number': [
-                r'SO[#:\s-]*(\d+[-\w]*)',
-                r'Sales Order[#:\s-]*(\d+[-\w]*)',
-            ],
-            'quote_number': [
-                r'Quote[#:\s-]*(\d+[-\w]*)',
-                r'Q[#:\s-]*(\d+[-\w]*)',
-                r'RFQ[#:\s-]*(\d+[-\w]*)',
-            ]
-        }
-
-        result = {}
-        for field, pats in patterns.items():
-            for pat in pats:
-                match = re.search(pat, text, re.IGNORECASE)
-                if match:
-                    result[field] = match.group(1)
-                    break
-
-        return result
+        return get_reference_extractor().extract(subject, body, from_email)
 
     def determine_priority(self, subject, body):
         """Determine task priority based on email content."""
-        text = f"{subject} {body}".lower()
-
-        high_priority_words = ['urgent', 'asap', 'immediately', 'critical', 'emergency', 'rush']
-        for word in high_priority_words:
-            if word in text:
-                return 'high'
+        return get_classifier().classify(subject, body)[3]
+
+    def get_uidvalidity(self, folder='INBOX'):
+        """Return the UIDVALIDITY of the currently selected folder."""
+        typ, data = self.connection.response('UIDVALIDITY')
+        if not data or data[0] is None:
+            typ, data = self.connection.status(quote_mailbox(folder), '(UIDVALIDITY)')
+            match = re.search(rb'UIDVALIDITY (\d+)', data[0] or b'') if typ == 'OK' else None
+            return int(match.group(1)) if match else None
+        return int(data[0])
+
+    def get_fetch_batch_size(self):
+        """Get number of UIDs requested per FETCH from settings or config."""
+        return max(1, int(Setting.get('fetch_batch_size') or Config.FETCH_BATCH_SIZE))
+
+    def get_body_fetch_max_bytes(self):
+        """Get the byte cap for body part fetches from settings or config."""
+        return int(Setting.get('body_fetch_max_bytes') or Config.BODY_FETCH_MAX_BYTES)
+
+    def fetch_messages(self, uids, items='(RFC822)', batch_size=None):
+        """Fetch messages in UID batches, yielding (uid, data) as each batch arrives.
+
+        Every UID in a batch whose FETCH failed is yielded as (uid, None) so the
+        caller can retry it later. UIDs missing from a successful response
+        (e.g. expunged in the meantime) are skipped.
+        """
+        batch_size = batch_size or self.get_fetch_batch_size()
 
-        return 'medium'
+        for start in range(0, len(uids), batch_size):
+            batch = uids[start:start + batch_size]
+            started = time.monotonic()
+            try:
+                status, msg_data = self.connection.uid('FETCH', ','.join(str(uid) for uid in batch), items)
+            except imaplib.IMAP4.abort:
+                raise
+            except Exception as e:
+                logger.error(f"FETCH of {len(batch)} messages failed: {e}")
+                status, msg_data = 'NO', []
+
+            elapsed_ms = (time.monotonic() - started) * 1000
+            if status != 'OK':
+                for uid in batch:
+                    yield uid, None
+                continue
+
+            logger.info(f"Fetched batch of {len(batch)} messages in {elapsed_ms:.0f} ms")
+            for i, item in enumerate(msg_data):
+                if isinstance(item, tuple):
+                    match = FETCH_UID_RE.search(item[0])
+                    # Some servers send the UID item after the literal
+                    if not match and i + 1 < len(msg_data) and isinstance(msg_data[i + 1], bytes):
+                        match = FETCH_UID_RE.search(msg_data[i + 1])
+                    if match:
+                        yield int(match.group(1)), item[1]
+
+    def fetch_headers(self, uids, batch_size=None):
+        """Fetch the header fields used for dedup and filtering, yielding (uid, header_bytes)."""
+        return self.fetch_messages(uids, HEADER_FETCH_ITEMS, batch_size)
+
+    def fetch_body_payloads(self, uids, batch_size=None, max_bytes=None):
+        """Fetch only the text body of each message, yielding (uid, payload).
+
+        Reads BODYSTRUCTURE first, then fetches just the first text/plain part
+        (or text/html) up to BODY_FETCH_MAX_BYTES, so attachments are never
+        downloaded. Messages whose structure could not be read fall back to a
+        full fetch. Payloads are still transfer-encoded; see
+        mail_parser.body_from_payload. Yields (uid, None) on failure.
+        """
+        batch_size = batch_size or self.get_fetch_batch_size()
+        max_bytes = max_bytes or self.get_body_fetch_max_bytes()
 
-    def scan_inbox(self, scan_all=False, days=None):
-        """Scan inbox for new emails and create tasks.
+        for start in range(0, len(uids), batch_size):
+            batch = uids[start:start + batch_size]
+            try:
+                status, msg_data = self.connection.uid('FETCH', ','.join(str(uid) for uid in batch), '(BODYSTRUCTURE)')
+            except imaplib.IMAP4.abort:
+                raise
+            except Exception as e:
+                logger.error(f"BODYSTRUCTURE fetch failed: {e}")
+                status, msg_data = 'NO', []
+
+            # Group messages by the section holding their text so each group is one FETCH
+            sections = {}
+            parts = {}
+            unknown = set(batch)
+            if status == 'OK':
+                for line in join_fetch_response(msg_data):
+                    try:
+                        items = parse_fetch_items(line)
+                        uid = int(items['UID'])
+                        part = find_text_part(items['BODYSTRUCTURE'])
+                    except (KeyError, ValueError, IndexError, TypeError):
+                        continue
+                    if uid not in unknown:
+                        continue
+                    unknown.discard(uid)
+                    if part:
+                        parts[uid] = part
+                        sections.setdefault(part[0], []).append(uid)
+                    else:
+                        yield uid, ('empty',)  # No text part at all (e.g. attachments only)
+
+            for section, part_uids in sections.items():
+                items = f'(BODY.PEEK[{section}]<0.{max_bytes}>)'
+                received = set()
+                for uid, payload in self.fetch_messages(part_uids, items, batch_size):
+                    if payload is None:
+                        yield uid, None
+                        continue
+                    received.add(uid)
+                    _, subtype, encoding, charset = parts[uid]
+                    yield uid, ('part', payload, subtype, encoding, charset)
+                for uid in part_uids:
+                    if uid not in received:
+                        yield uid, ('empty',)  # Empty part is returned as "" rather than a literal
+
+            # Fall back to downloading the whole message
+            for uid, raw_email in self.fetch_messages(sorted(unknown), BODY_FETCH_ITEMS, batch_size):
+                if raw_email is None:
+                    yield uid, None
+                else:
+                    yield uid, ('message', raw_email)
+
+    def scan_inbox(self, scan_all=False, days=None, incremental=False, folder='INBOX', concurrent=False,
+                   progress=None):
+        """Scan a folder for new emails and create tasks.
 
         Args:
             scan_all: If True, scan all emails. If False, only scan unseen emails.
             days: If specified, scan emails from the past N days.
+            incremental: If True, only fetch UIDs above the stored high-water mark.
+                Falls back to the scan_all/days search when there is no stored
+                state or the folder's UIDVALIDITY has changed. The mark is
+                advanced after every batch, so an interrupted or budget-limited
+                scan continues where it stopped. Other scans resume after the
+                checkpoint of an unfinished earlier run of the same search.
+            folder: Folder to scan.
+            concurrent: Set when other mailboxes are being scanned at the same time.
+            progress: Optional scan_jobs.JobProgress to report progress to.
         """
-        if not self.connect():
+        # Reuse an already open session (e.g. the IDLE worker's) and leave it open
+        owns_connection = self.connection is None
+        if owns_connection and not self.connect():
             return {'success': False, 'message': 'Could not connect to IMAP', 'tasks_created': 0, 'emails_scanned': 0}
 
-        tasks_created = 0
-        emails_scanned = 0
-        emails_skipped_marketing = 0
-        emails_skipped_no_trigger = 0
-        emails_skipped_duplicate = 0
-        errors = []
+        mode = 'full'
+        pipeline = ScanPipeline(self, get_classifier(), get_reference_extractor(), folder=folder,
+                                concurrent=concurrent, progress=progress)
 
         try:
-            self.connection.select('INBOX')
+            status, _ = self.connection.select(quote_mailbox(folder))
+            if status != 'OK':
+                raise RuntimeError(f'Could not select folder {folder}')
+
+            uidvalidity = self.get_uidvalidity(folder)
+            account = self.get_config()['email']
+            with pipeline.write_phase():
+                state = MailboxState.get_or_create(account, folder)
+                if state.uidvalidity is not None and state.uidvalidity != uidvalidity:
+                    # UIDs of the old epoch mean nothing now, even if the rescan below finds no mail
+                    logger.info(f"UIDVALIDITY changed for {folder}, falling back to full rescan")
+                    state.uidvalidity = uidvalidity
+                    state.last_uid = 0
+                    state.resume_search = None
+                    state.resume_uid = None
+                    state.failed_attempts = None
+                last_uid = state.last_uid or 0
+                resume_search, resume_uid = state.resume_search, state.resume_uid or 0
+                newest_uid = (state.newest_uid or 0) if state.newest_uidvalidity == uidvalidity else 0
+                pipeline.cache = MessageCache.create(account, folder, uidvalidity)
+                pipeline.attempts = {int(uid): n for uid, n in json.loads(state.failed_attempts or '{}').items()}
+            if incremental and state.uidvalidity == uidvalidity and last_uid:
+                mode = 'incremental'
 
             # Search for emails based on parameters
-            if days:
+            if mode == 'incremental':
+                search = f'UID {last_uid + 1}:*'
+                status, messages = self.connection.uid('SEARCH', None, search)
+            elif days:
                 # Search for emails from the past N days
+                search = f'days {days}'
                 since_date = (datetime.now() - timedelta(days=days)).strftime('%d-%b-%Y')
-                status, messages = self.connection.search(None, f'SINCE {since_date}')
+                status, messages = self.connection.uid('SEARCH', None, f'SINCE {since_date}')
             elif scan_all:
-                status, messages = self.connection.search(None, 'ALL')
+                search = 'all'
+                status, messages = self.connection.uid('SEARCH', None, 'ALL')
             else:
-                status, messages = self.connection.search(None, 'UNSEEN')
+                search = 'unseen'
+                status, messages = self.connection.uid('SEARCH', None, 'UNSEEN')
 
             if status != 'OK':
                 return {'success': False, 'message': 'Failed to search inbox', 'tasks_created': 0, 'emails_scanned': 0}
 
-            email_ids = messages[0].split()
-            logger.info(f"Found {len(email_ids)} {'total' if scan_all else 'unread'} emails")
-
-            for email_id in email_ids:
-                try:
-                    # Fetch email
-                    status, msg_data = self.connection.fetch(email_id, '(RFC822)')
-                    if status != 'OK':
-                        continue
-
-                    raw_email = msg_data[0][1]
-                    msg = email.message_from_bytes(raw_email)
-
-                    # Get message ID
-                    message_id = msg.get('Message-ID', '')
-                    emails_scanned += 1
-
-                    # Decode headers
-                    subject = self.decode_email_header(msg.get('Subject', ''))
-                    from_header = self.decode_email_header(msg.get('From', ''))
-                    _, from_email = parseaddr(from_header)
-                    body = self.get_email_body(msg)
-
-                    # Check if already processed
-                    if ProcessedEmail.query.filter_by(message_id=message_id).first():
-                        emails_skipped_duplicate += 1
-                        # Log it
-                        log = EmailScanLog(
-                            message_id=message_id,
-                            subject=subject[:500] if subject else '',
-                            from_address=from_email,
-                            result='skipped_duplicate',
-                            reason='Already processed'
-                        )
-                        db.session.add(log)
-                        db.session.commit()
-                        continue
-
-                    # Skip marketing emails
-                    marketing_word = self.is_marketing_email(subject, body, from_header)
-                    if marketing_word:
-                        emails_skipped_marketing += 1
-                        # Mark as processed but don't create task
-                        processed = ProcessedEmail(message_id=message_id, folder='INBOX')
-                        db.session.add(processed)
-                        # Log it
-                        log = EmailScanLog(
-                            message_id=message_id,
-                            subject=subject[:500] if subject else '',
-                            from_address=from_email,
-                            result='skipped_marketing',
-                            reason=f'Marketing filter: "{marketing_word}"'
-                        )
-                        db.session.add(log)
-                        db.session.commit()
-                        continue
-
-                    # Check for trigger words
-                    category, trigger_word = self.detect_trigger_category(subject, body)
-                    if not category:
-                        emails_skipped_no_trigger += 1
-                        # Log it but don't mark as processed (might match future trigger words)
-                        log = EmailScanLog(
-                            message_id=message_id,
-                            subject=subject[:500] if subject else '',
-                            from_address=from_email,
-                            result='skipped_no_trigger',
-                            reason='No trigger words found'
-                        )
-                        db.session.add(log)
-                        db.session.commit()
-                        continue
-
-                    # Extract information
-                    customer_info = self.extract_customer_info(from_header, body)
-                    ref_numbers = self.extract_reference_numbers(subject, body)
-                    priority = self.determine_priority(subject, body)
-
-                    # Check for existing task with same thread (normalized subject)
-                    # Match any task with the same base subject, regardless of sender
-                    normalized_subj = normalize_subject(subject)
-                    existing_task = None
-                    if normalized_subj and len(normalized_subj) > 5:  # Only check if subject is meaningful
-                        # Look for tasks where the normalized title matches
-                        all_tasks = Task.query.all()
-                        for t in all_tasks:
-                            if normalize_subject(t.title).lower() == normalized_subj.lower():
-                                existing_task = t
-                                break
-
-                    if existing_task:
-                        emails_skipped_duplicate += 1
-                        # Mark as processed but don't create new task
-                        processed = ProcessedEmail(message_id=message_id, folder='INBOX')
-                        db.session.add(processed)
-                        log = EmailScanLog(
-                            message_id=message_id,
-                            subject=subject[:500] if subject else '',
-                            from_address=from_email,
-                            result='skipped_thread',
-                            reason=f'Thread exists: Task #{existing_task.id}'
-                        )
-                        db.session.add(log)
-                        db.session.commit()
-                        continue
-
-                    # Get email date and calculate due date based on it
-                    due_days = int(Setting.get('default_due_days') or Config.DEFAULT_DUE_DAYS)
-                    email_date = None
-                    try:
-                        date_header = msg.get('Date')
-                        if date_header:
-                            email_date = parsedate_to_datetime(date_header)
-                    except Exception:
-                        pass
-
-                    # Use email date + due_days, or fallback to today + due_days
-                    if email_date:
-                        due_date = (email_date + timedelta(days=due_days)).date()
-                    else:
-                        due_date = datetime.now().date() + timedelta(days=due_days)
-
-                    # Create task
-                    task = Task(
-                        title=subject[:500] if subject else f"Email from {customer_info['name']}",
-                        description=body[:5000] if body else '',
-                        customer_name=customer_info['name'],
-                        customer_email=customer_info['email'],
-                        company=customer_info['company'],
-                        po_number=ref_numbers.get('po_number'),
-                        so_number=ref_numbers.get('so_number'),
-                        quote_number=ref_numbers.get('quote_number'),
-                        priority=priority,
-                        due_date=due_date,
-                        status='scheduled',
-                        source_email_id=message_id
-                    )
-
-                    db.session.add(task)
-                    db.session.flush()  # Get the task ID
-
-                    # Mark email as processed
-                    processed = ProcessedEmail(message_id=message_id, folder='INBOX')
-                    db.session.add(processed)
-
-                    # Log it
-                    log = EmailScanLog(
-                        message_id=message_id,
-                        subject=subject[:500] if subject else '',
-                        from_address=from_email,
-                        result='created',
-                        reason=f'Trigger: "{trigger_word}" ({category})',
-                        task_id=task.id
-                    )
-                    db.session.add(log)
-
-                    db.session.commit()
-                    tasks_created += 1
-
-                    logger.info(f"Created task: {task.title[:50]}...")
-
-                except Exception as e:
-                    logger.error(f"Error processing email {email_id}: {e}")
-                    errors.append(str(e))
-                    db.session.rollback()
+            email_ids = sorted(int(uid) for uid in messages[0].split())
+            # Mail that arrived since the previous scans, whatever the search (for the adaptive interval)
+            new_messages = sum(1 for uid in email_ids if uid > newest_uid)
+            found_uid = email_ids[-1] if email_ids else 0
+            if mode == 'incremental':
+                # "n:*" always matches the highest UID, even when it is below n
+                email_ids = [uid for uid in email_ids if uid > last_uid]
+            else:
+                # Checkpoints are only valid while the folder's UIDVALIDITY is unchanged
+                search = f'{uidvalidity}:{search}'
+                if search == resume_search:
+                    logger.info(f"Resuming unfinished scan of {folder} after UID {resume_uid}")
+                    email_ids = [uid for uid in email_ids if uid > resume_uid]
+            logger.info(f"Found {len(email_ids)} emails to scan in {folder} ({mode})")
+
+            def checkpoint(uid):
+                if incremental:
+                    # Advance the high-water mark, but never past a message that failed
+                    # so it is retried on the next scan
+                    state.last_uid = max(last_uid, uid) if mode == 'incremental' else uid
+                    state.uidvalidity = uidvalidity
+                elif uid > 0:
+                    state.resume_search = search
+                    state.resume_uid = uid
+                # Failure counts of the emails not got past yet
+                attempts = {failed: n for failed, n in pipeline.attempts.items() if failed > uid}
+                state.failed_attempts = json.dumps(attempts) if attempts else None
+
+            pipeline.checkpoint = checkpoint
+
+            # Large backfills decode and classify bodies in worker processes
+            pipeline.pool = ParsePool.create(len(email_ids), pipeline.classifier, pipeline.extractor)
+
+            pipeline.run(email_ids)
+
+            with pipeline.write_phase():
+                state.newest_uid = max(newest_uid, found_uid)
+                state.newest_uidvalidity = uidvalidity
+                if incremental:
+                    state.uidvalidity = uidvalidity
+                elif not pipeline.remaining and not pipeline.failed_uids:
+                    # Finished: the next scan starts over
+                    state.resume_search = None
+                    state.resume_uid = None
+                if pipeline.cache:
+                    evict_messages()
 
         except Exception as e:
             logger.error(f"Error scanning inbox: {e}")
-            return {'success': False, 'message': str(e), 'tasks_created': tasks_created, 'emails_scanned': emails_scanned}
+            pipeline.writer.commit()
+            return {
+                'success': False,
+                'message': str(e),
+                'tasks_created': len(pipeline.writer.created_task_ids),
+                'emails_scanned': pipeline.counts['scanned'],
+                'stages': pipeline.stage_report()
+            }
         finally:
-            self.disconnect()
+            if pipeline.pool:
+                pipeline.pool.close()
+            if owns_connection:
+                self.disconnect()
 
+        tasks_created = len(pipeline.writer.created_task_ids)
+        emails_scanned = pipeline.counts['scanned']
+        message = f'Scan complete. Scanned {emails_scanned} emails, created {tasks_created} tasks.'
+        if pipeline.remaining:
+            message = (f'Scan budget used up. Scanned {emails_scanned} emails, created {tasks_created} tasks, '
+                       f'{pipeline.remaining} emails left for the next scan.')
         return {
             'success': True,
-            'message': f'Scan complete. Scanned {emails_scanned} emails, created {tasks_created} tasks.',
+            'message': message,
             'tasks_created': tasks_created,
             'emails_scanned': emails_scanned,
-            'skipped_marketing': emails_skipped_marketing,
-            'skipped_no_trigger': emails_skipped_no_trigger,
-            'skipped_duplicate': emails_skipped_duplicate,
-            'errors': errors if errors else None
+            'remaining': pipeline.remaining,
+            'new_messages': new_messages,
+            'cached_headers': pipeline.counts['cached_headers'],
+            'cached_bodies': pipeline.counts['cached_bodies'],
+            'skipped_marketing': pipeline.counts['skipped_marketing'],
+            'skipped_no_trigger': pipeline.counts['skipped_no_trigger'],
+            'skipped_duplicate': pipeline.counts['skipped_duplicate'],
+            'skipped_failed': pipeline.counts['skipped_failed'],
+            'mode': mode,
+            'created_task_ids': pipeline.writer.created_task_ids,
+            'commits': pipeline.writer.commits,
+            'lock_wait_ms': round(pipeline.writer.lock_wait_ms),
+            'stages': pipeline.stage_report(),
+            'errors': pipeline.errors if pipeline.errors else None
         }
 
 
+def get_mailboxes():
+    """Get the (account, folder) pairs to scan.
+
+    The mailboxes setting (or MAILBOXES) is a JSON list of accounts such as
+    {"email": "sales@example.com", "password": "...", "folders": ["INBOX", "Quotes"]}.
+    Connection fields left out fall back to the primary IMAP settings, so
+    {"folders": [...]} adds folders of the primary account. Without it
+    only the primary INBOX is scanned.
+    """
+    raw = Setting.get('mailboxes') or Config.MAILBOXES
+    entries = []
+    if raw:
+        try:
+            entries = json.loads(raw)
+        except ValueError:
+            logger.warning("mailboxes setting is not valid JSON, scanning the primary INBOX only")
+
+    mailboxes = []
+    for entry in entries or [{}]:
+        account = {key: value for key, value in entry.items() if key != 'folders'}
+        for folder in entry.get('folders') or ['INBOX']:
+            mailboxes.append((account, folder))
+    return mailboxes
+
+
+def merge_scan_results(results):
+    """Combine per-mailbox scan results into one result dict."""
+    total = {
+        'success': all(r['success'] for r in results),
+        'tasks_created': 0,
+        'emails_scanned': 0,
+        'skipped_marketing': 0,
+        'skipped_no_trigger': 0,
+        'skipped_duplicate': 0,
+        'remaining': 0,
+        'new_messages': 0,
+        'cached_headers': 0,
+        'cached_bodies': 0,
+        'created_task_ids': [],
+        'commits': 0,
+        'lock_wait_ms': 0,
+        'stages': {},
+        'errors': [],
+        'mailboxes': results
+    }
+    for result in results:
+        for key in ('tasks_created', 'emails_scanned', 'skipped_marketing', 'skipped_no_trigger',
+                    'skipped_duplicate', 'remaining', 'new_messages', 'cached_headers', 'cached_bodies', 'commits',
+                    'lock_wait_ms'):
+            total[key] += result.get(key, 0)
+        total['created_task_ids'].extend(result.get('created_task_ids', []))
+        total['errors'].extend(result.get('errors') or [])
+        if not result['success']:
+            total['errors'].append(f"{result['account']}/{result['folder']}: {result['message']}")
+        for name, stats in result.get('stages', {}).items():
+            merged = total['stages'].setdefault(name, dict.fromkeys(stats, 0))
+            for key, value in stats.items():
+                merged[key] = round(merged[key] + value, 1)
+
+    modes = {r['mode'] for r in results if 'mode' in r}
+    total['mode'] = modes.pop() if len(modes) == 1 else 'mixed'
+    total['message'] = (f"Scan complete. Scanned {total['emails_scanned']} emails in {len(results)} mailboxes, "
+                        f"created {total['tasks_created']} tasks.")
+    if total['remaining']:
+        total['message'] += f" Scan budget used up, {total['remaining']} emails left for the next scan."
+    total['errors'] = total['errors'] or None
+    return total
+
+
+def scan_mailboxes(app, **scan_args):
+    """Scan every configured mailbox, each over its own connection.
+
+    Mailboxes are scanned in parallel threads, so a scan takes about as
+    long as the slowest mailbox. A single mailbox is scanned inline.
+    """
+    mailboxes = get_mailboxes()
+    concurrent = len(mailboxes) > 1
+
+    def scan(account, folder):
+        with app.app_context():
+            service = EmailService(app, account)
+            address = service.get_config()['email']
+            result = service.scan_inbox(folder=folder, concurrent=concurrent, **scan_args)
+            result['account'] = address
+            result['folder'] = folder
+            return result
+
+    if not concurrent:
+        account, folder = mailboxes[0]
+        if not account and folder == 'INBOX':
+            # A fresh service each time: the singleton's connection is not thread-safe
+            return EmailService(app).scan_inbox(**scan_args)
+        return scan(account, folder)
+
+    workers = min(len(mailboxes), int(Setting.get('mailbox_scan_workers') or Config.MAILBOX_SCAN_WORKERS))
+    # End this thread's read transaction; on SQLite it would block the scans' commits
+    db.session.commit()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='mailbox-scan') as executor:
+        futures = [executor.submit(scan, account, folder) for account, folder in mailboxes]
+        results = []
+        for (account, folder), future in zip(mailboxes, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Scan of {account.get('email') or 'primary'}/{folder} failed: {e}")
+                results.append({'success': False, 'message': str(e), 'tasks_created': 0, 'emails_scanned': 0,
+                                'account': account.get('email') or '', 'folder': folder})
+
+    return merge_scan_results(results)
+
+
 # Singleton instance
 email_service = EmailService()
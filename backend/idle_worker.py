@@ -0,0 +1,151 @@
+import logging
+import re
+import select
+import ssl
+import threading
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Untagged "* 12 EXISTS" response announcing new mail
+EXISTS_RE = re.compile(rb'^\* \d+ EXISTS', re.IGNORECASE)
+
+
+class IdleWorker:
+    """Background worker holding one IMAP session in IDLE.
+
+    Every EXISTS notification triggers an incremental scan over the same
+    authenticated session, so new mail becomes a task within seconds instead
+    of waiting for the next interval scan.
+    """
+
+    def __init__(self, app, folder='INBOX'):
+        self.app = app
+        self.folder = folder
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        from email_service import EmailService
+        self.service = EmailService(app)
+
+    def start(self):
+        """Start the worker thread."""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='imap-idle', daemon=True)
+        self.thread.start()
+        logger.info("IMAP IDLE worker started")
+
+    def stop(self):
+        """Stop the worker and close its session."""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+
+    def run(self):
+        """Keep an IDLE session alive, reconnecting with exponential backoff."""
+        backoff = 5
+
+        while not self.stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    connected = self.service.connect()
+                if not connected:
+                    raise ConnectionError('Could not connect to IMAP')
+
+                # Capabilities can change after LOGIN, so ask again
+                _, data = self.service.connection.capability()
+                if b'IDLE' not in (data[0] or b'').upper().split():
+                    logger.warning("IMAP server does not support IDLE, push mode disabled")
+                    return
+
+                backoff = 5
+                # Catch up on anything that arrived while disconnected
+                self.scan()
+                while not self.stop_event.is_set():
+                    if self.idle():
+                        self.scan()
+            except Exception as e:
+                logger.error(f"IMAP IDLE session failed: {e}. Reconnecting in {backoff}s")
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, Config.IMAP_IDLE_MAX_BACKOFF_SECONDS)
+            finally:
+                self.service.disconnect()
+
+    def scan(self):
+        """Run an incremental scan over the IDLE session."""
+        from scheduler import run_scan
+        run_scan(self.app, self.service, incremental=True)
+        # The scan may have left another folder selected
+        self.service.connection.select(self.folder)
+
+    def buffered(self):
+        """Whether data already read off the socket is waiting in imaplib's file buffer.
+
+        select() only sees the socket, so after a readline() the lines that
+        arrived in the same packet would otherwise sit unnoticed. The peek
+        runs with the socket non-blocking so an empty buffer doesn't wait.
+        """
+        conn = self.service.connection
+        timeout = conn.sock.gettimeout()
+        conn.sock.settimeout(0)
+        try:
+            return bool(conn.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            conn.sock.settimeout(timeout)
+
+    def wait_readable(self, timeout):
+        """Wait until the server has sent data, without consuming it."""
+        if self.buffered():
+            return True
+        sock = self.service.connection.sock
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        readable, _, _ = select.select([sock], [], [], timeout)
+        return bool(readable)
+
+    def idle(self):
+        """Issue IDLE until new mail arrives or the refresh interval elapses.
+
+        Returns True when the server reported new mail.
+        """
+        conn = self.service.connection
+        tag = conn._new_tag()
+        conn.send(tag + b' IDLE\r\n')
+
+        response = conn.readline()
+        if not response.startswith(b'+'):
+            raise RuntimeError(f'IDLE rejected: {response.strip()!r}')
+
+        deadline = time.monotonic() + Config.IMAP_IDLE_REFRESH_MINUTES * 60
+        new_mail = False
+        while not new_mail and not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Short slices so stop() is noticed promptly
+            if not self.wait_readable(min(remaining, 5)):
+                continue
+            line = conn.readline()
+            if not line:
+                raise ConnectionError('IMAP server closed the connection')
+            new_mail = bool(EXISTS_RE.match(line))
+
+        conn.send(b'DONE\r\n')
+        while True:
+            line = conn.readline()
+            if not line:
+                raise ConnectionError('IMAP server closed the connection')
+            if line.startswith(tag):
+                break
+            if EXISTS_RE.match(line):
+                new_mail = True
+
+        if new_mail:
+            logger.info("IMAP IDLE: new mail notification received")
+        return new_mail
@@ -0,0 +1,92 @@
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, SchedulerLease
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Lease of the process running background scans and scan jobs
+SCHEDULER_LEASE = 'scan-scheduler'
+
+
+class LeaderLease:
+    """Lease row in the database electing a single leader among processes.
+
+    Every process calls renew() periodically. The holder extends the lease
+    each time; the others take it over once it has lapsed, i.e. when the
+    leader died or stopped renewing. A process considers itself leader only
+    until its last successful renewal plus the lease time, measured on its
+    own monotonic clock, so it steps down on its own when it cannot reach
+    the database.
+    """
+
+    def __init__(self, app, name=SCHEDULER_LEASE, seconds=None):
+        self.app = app
+        self.name = name
+        self.seconds = seconds or Config.SCHEDULER_LEASE_SECONDS
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.valid_until = 0.0
+
+    @property
+    def is_leader(self):
+        return time.monotonic() < self.valid_until
+
+    def renew(self):
+        """Take or extend the lease. Returns whether this process holds it."""
+        started = time.monotonic()
+        with self.app.app_context():
+            now = datetime.utcnow()
+            values = {'holder': self.holder, 'expires_at': now + timedelta(seconds=self.seconds)}
+            try:
+                taken = SchedulerLease.query.filter(
+                    SchedulerLease.name == self.name,
+                    or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now)
+                ).update(values, synchronize_session=False)
+                if not taken and SchedulerLease.query.get(self.name) is None:
+                    db.session.add(SchedulerLease(name=self.name, **values))
+                    taken = 1
+                db.session.commit()
+            except IntegrityError:
+                # Another process created the row first
+                db.session.rollback()
+                taken = 0
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not renew the {self.name} lease: {e}")
+                return self.is_leader
+
+        was_leader = self.is_leader
+        self.valid_until = started + self.seconds if taken else 0.0
+        if self.is_leader != was_leader:
+            logger.info(f"{self.holder} {'became' if taken else 'is no longer'} the {self.name} leader")
+        return self.is_leader
+
+    def release(self):
+        """Give the lease up so another process can take over right away."""
+        if not self.is_leader:
+            return
+        self.valid_until = 0.0
+        with self.app.app_context():
+            try:
+                SchedulerLease.query.filter_by(name=self.name, holder=self.holder).update(
+                    {'expires_at': datetime.utcnow()}, synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not release the {self.name} lease: {e}")
+
+
+def lease_holder(name=SCHEDULER_LEASE):
+    """Return the holder of a lease, or None if nobody holds it right now."""
+    lease = SchedulerLease.query.get(name)
+    if lease is None or lease.expires_at < datetime.utcnow():
+        return None
+    return lease.holder
@@ -0,0 +1,241 @@
+import base64
+import binascii
+import email
+import quopri
+import re
+from html.parser import HTMLParser
+
+# Tokens of an IMAP FETCH response: parens, quoted strings and atoms
+TOKEN_RE = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+# Literal marker ("{123}") at the end of a FETCH response line
+LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+
+# Start of an untagged FETCH response for a new message ("12 (")
+FETCH_START_RE = re.compile(rb'^\d+ \(')
+
+
+def quote_literal(data):
+    """Turn an IMAP literal into a quoted string so it can be tokenized inline."""
+    return b'"' + data.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+def quote_mailbox(name):
+    """Quote a mailbox name for an IMAP command when it isn't a plain atom."""
+    if name and re.fullmatch(r'[A-Za-z0-9_./-]+', name):
+        return name
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def join_fetch_response(msg_data):
+    """Reassemble imaplib FETCH output into one bytes line per message.
+
+    imaplib splits a response at every literal into (prefix, literal) tuples;
+    the literals are inlined back as quoted strings.
+    """
+    lines = []
+    current = b''
+    for item in msg_data:
+        head = item[0] if isinstance(item, tuple) else item
+        if not head:
+            continue
+        if current and FETCH_START_RE.match(head):
+            lines.append(current)
+            current = b''
+        if isinstance(item, tuple):
+            current += LITERAL_RE.sub(b'', item[0]) + quote_literal(item[1])
+        else:
+            current += item
+    if current:
+        lines.append(current)
+    return lines
+
+
+def parse_list(data):
+    """Parse a parenthesized IMAP response into nested Python lists.
+
+    Quoted strings become str, NIL becomes None, other atoms stay str.
+    """
+    stack = [[]]
+    for token in TOKEN_RE.findall(data):
+        if token == b'(':
+            stack.append([])
+        elif token == b')':
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        elif token.startswith(b'"'):
+            value = re.sub(rb'\\(.)', rb'\1', token[1:-1])
+            stack[-1].append(value.decode('utf-8', errors='replace'))
+        elif token.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token.decode('ascii', errors='replace'))
+    while len(stack) > 1:
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def parse_fetch_items(line):
+    """Parse one FETCH response line ("5 (UID 12 BODYSTRUCTURE (...))") into a dict."""
+    parsed = parse_list(line)
+    items = next((p for p in parsed if isinstance(p, list)), [])
+    return {str(items[i]).upper(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+
+
+def _params(value):
+    if not isinstance(value, list):
+        return {}
+    return {str(value[i]).lower(): value[i + 1] for i in range(0, len(value) - 1, 2)}
+
+
+def _is_attachment(part, disposition_index):
+    disposition = part[disposition_index] if len(part) > disposition_index else None
+    return isinstance(disposition, list) and str(disposition[0]).lower() == 'attachment'
+
+
+def iter_text_parts(structure, prefix=''):
+    """Yield (section, subtype, encoding, charset) for every inline text part."""
+    if not structure:
+        return
+
+    if isinstance(structure[0], list):
+        # Multipart: child parts come first, followed by the subtype and extension data
+        for i, child in enumerate(structure):
+            if not isinstance(child, list):
+                break
+            yield from iter_text_parts(child, f'{prefix}{i + 1}.')
+        return
+
+    if str(structure[0]).lower() != 'text' or _is_attachment(structure, 9):
+        return
+
+    section = prefix.rstrip('.') or '1'
+    yield (section, str(structure[1]).lower(), str(structure[5] or '7bit').lower(),
+           _params(structure[2]).get('charset') or 'utf-8')
+
+
+def find_text_part(structure):
+    """Return the first text/plain part, else the first text/html one, else None."""
+    parts = list(iter_text_parts(structure))
+    for wanted in ('plain', 'html'):
+        for part in parts:
+            if part[1] == wanted:
+                return part
+    return None
+
+
+def decode_part(payload, encoding, charset):
+    """Decode a (possibly truncated) transfer-encoded body part to text."""
+    if encoding == 'base64':
+        payload = re.sub(rb'[^A-Za-z0-9+/=]', b'', payload)
+        payload = payload[:len(payload) - len(payload) % 4]
+        try:
+            payload = base64.b64decode(payload)
+        except binascii.Error:
+            return ''
+    elif encoding == 'quoted-printable':
+        payload = quopri.decodestring(payload)
+
+    try:
+        return payload.decode(charset, errors='replace')
+    except LookupError:
+        return payload.decode('utf-8', errors='replace')
+
+
+class _TextExtractor(HTMLParser):
+    """Collect visible text from an HTML document."""
+
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'table'}
+    SKIP_TAGS = {'script', 'style', 'head'}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Convert an HTML body to plain text."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass
+    text = ''.join(parser.parts)
+    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    return re.sub(r'\n\s*\n+', '\n\n', text).strip()
+
+
+def message_body(msg):
+    """Extract the plain text body of a parsed message, falling back to the HTML part."""
+    body = ''
+    html = ''
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            if content_type == 'text/plain':
+                try:
+                    payload = part.get_payload(decode=True)
+                    charset = part.get_content_charset() or 'utf-8'
+                    body = payload.decode(charset, errors='replace')
+                    break
+                except:
+                    pass
+            elif content_type == 'text/html' and not html:
+                try:
+                    payload = part.get_payload(decode=True)
+                    charset = part.get_content_charset() or 'utf-8'
+                    html = payload.decode(charset, errors='replace')
+                except:
+                    pass
+    else:
+        try:
+            payload = msg.get_payload(decode=True)
+            charset = msg.get_content_charset() or 'utf-8'
+            body = payload.decode(charset, errors='replace')
+            if msg.get_content_type() == 'text/html':
+                body = html_to_text(body)
+        except:
+            pass
+
+    if not body and html:
+        body = html_to_text(html)
+
+    return body
+
+
+def body_from_payload(payload):
+    """Turn a fetched body payload into text.
+
+    The payload is ('part', data, subtype, encoding, charset) for a single
+    text part, ('message', raw_bytes) for a whole message, ('text', body)
+    for text already decoded (e.g. from the message cache), or ('empty',)
+    when the message has no text to fetch.
+    """
+    if payload[0] == 'empty':
+        return ''
+    if payload[0] == 'text':
+        return payload[1]
+    if payload[0] == 'message':
+        return message_body(email.message_from_bytes(payload[1]))
+    _, data, subtype, encoding, charset = payload
+    body = decode_part(data, encoding, charset)
+    return html_to_text(body) if subtype == 'html' else body
@@ -0,0 +1,129 @@
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from models import db, CachedMessage, CachedLocation, Setting
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCache:
+    """The message cache as seen by the scan of one folder.
+
+    Headers are looked up by the folder's UIDVALIDITY and UID, before the
+    header fetch, through the locations the message was seen at in every
+    folder. Body text is looked up by Message-ID, before the body
+    fetch, so a message already fetched from another folder is not
+    downloaded again either.
+    """
+
+    def __init__(self, account, folder, uidvalidity):
+        self.account = account
+        self.folder = folder
+        self.uidvalidity = uidvalidity
+
+    @staticmethod
+    def create(account, folder, uidvalidity):
+        """Return the cache for a folder, or None when caching is disabled."""
+        enabled = (Setting.get('message_cache_enabled') or str(Config.MESSAGE_CACHE_ENABLED)).lower() == 'true'
+        if not enabled or uidvalidity is None:
+            return None
+        return MessageCache(account, folder, uidvalidity)
+
+    def headers(self, uids):
+        """Return {uid: header_bytes} for the UIDs whose headers are cached."""
+        if not uids:
+            return {}
+        rows = db.session.query(CachedLocation.uid, CachedMessage.headers).join(
+            CachedMessage, CachedMessage.message_id == CachedLocation.message_id
+        ).filter(
+            CachedLocation.account == self.account,
+            CachedLocation.folder == self.folder,
+            CachedLocation.uidvalidity == self.uidvalidity,
+            CachedLocation.uid.in_(uids)
+        )
+        return {uid: zlib.decompress(headers) for uid, headers in rows if headers is not None}
+
+    def bodies(self, message_ids):
+        """Return {message_id: text} for the messages whose body text is cached."""
+        message_ids = [m for m in message_ids if m]
+        if not message_ids:
+            return {}
+        rows = db.session.query(CachedMessage.message_id, CachedMessage.body).filter(
+            CachedMessage.message_id.in_(message_ids),
+            CachedMessage.body.isnot(None)
+        )
+        return {message_id: zlib.decompress(body).decode('utf-8') for message_id, body in rows}
+
+    def save(self, items):
+        """Store or refresh the scanned emails of a batch, inside the scan's write phase."""
+        items = [item for item in items
+                 if item.message_id and item.raw_headers is not None and not item.failed and item.result != 'vanished']
+        if not items:
+            return
+
+        existing = {row.message_id: row for row in
+                    CachedMessage.query.filter(CachedMessage.message_id.in_({item.message_id for item in items}))}
+        locations = {location.uid: location for location in CachedLocation.query.filter(
+            CachedLocation.account == self.account,
+            CachedLocation.folder == self.folder,
+            CachedLocation.uidvalidity == self.uidvalidity,
+            CachedLocation.uid.in_([item.uid for item in items])
+        )}
+        now = datetime.utcnow()
+        for item in items:
+            row = existing.get(item.message_id)
+            if row is None:
+                row = CachedMessage(message_id=item.message_id, headers=zlib.compress(item.raw_headers))
+                db.session.add(row)
+                existing[item.message_id] = row
+            row.account = self.account
+            row.folder = self.folder
+            row.uidvalidity = self.uidvalidity
+            row.uid = item.uid
+            row.last_used_at = now
+
+            location = locations.get(item.uid)
+            if location is None:
+                location = CachedLocation(account=self.account, folder=self.folder, uidvalidity=self.uidvalidity,
+                                          uid=item.uid)
+                db.session.add(location)
+                locations[item.uid] = location
+            location.message_id = item.message_id
+
+            analysis = item.analysis
+            if row.body is None and analysis and 'body' in analysis:
+                row.body = zlib.compress(analysis['body'].encode('utf-8'))
+            row.size = len(row.headers or b'') + len(row.body or b'')
+
+
+def evict_messages(max_mb=None, max_age_days=None):
+    """Drop entries unused for the maximum age, then the least recently used beyond the size limit."""
+    max_mb = max_mb or int(Setting.get('message_cache_max_mb') or Config.MESSAGE_CACHE_MAX_MB)
+    max_age_days = max_age_days or int(Setting.get('message_cache_max_age_days') or Config.MESSAGE_CACHE_MAX_AGE_DAYS)
+
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    removed = CachedMessage.query.filter(CachedMessage.last_used_at < cutoff).delete(synchronize_session=False)
+
+    total = db.session.query(db.func.coalesce(db.func.sum(CachedMessage.size), 0)).scalar()
+    excess = total - max_mb * 1024 * 1024
+    if excess > 0:
+        ids = []
+        for row_id, size in db.session.query(CachedMessage.id, CachedMessage.size).order_by(
+                CachedMessage.last_used_at, CachedMessage.id).yield_per(1000):
+            ids.append(row_id)
+            excess -= size or 0
+            if excess <= 0:
+                break
+        for start in range(0, len(ids), 500):
+            CachedMessage.query.filter(CachedMessage.id.in_(ids[start:start + 500])).delete(
+                synchronize_session=False)
+        removed += len(ids)
+
+    if removed:
+        CachedLocation.query.filter(
+            CachedLocation.message_id.notin_(db.select(CachedMessage.message_id))
+        ).delete(synchronize_session=False)
+        logger.info(f"Evicted {removed} messages from the message cache")
+    return removed
@@ -1,13 +1,55 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import validates
 import json
+import re
 
 db = SQLAlchemy()
 
 
+def enable_sqlite_savepoints(engine):
+    """Make SAVEPOINTs work on SQLite by emitting BEGIN ourselves.
+
+    pysqlite starts transactions lazily, so otherwise the first SAVEPOINT
+    opens the transaction and its RELEASE commits everything.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def emit_begin(conn):
+        conn.exec_driver_sql('BEGIN')
+
+
+def normalize_subject(subject):
+    """Strip Re:, Fwd:, etc. prefixes to get the base subject for thread grouping."""
+    if not subject:
+        return ''
+
+    # Pattern to match common reply/forward prefixes (case-insensitive)
+    # Handles: Re:, RE:, Fwd:, FW:, Fw:, and multiple prefixes like "Re: Re: Re:"
+    pattern = r'^(?:\s*(?:re|fwd?|fw)\s*:\s*)+'
+    normalized = re.sub(pattern, '', subject, flags=re.IGNORECASE).strip()
+    return normalized
+
+
+def make_subject_key(subject):
+    """Case-folded normalized subject used to match emails to task threads."""
+    return normalize_subject(subject).casefold()
+
+
 class Task(db.Model):
     """Main task model - can be created from emails or manually."""
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # Board order of the task list, walked by keyset pagination
+        db.Index('ix_tasks_board_order', 'due_date', db.text('created_at DESC'), db.text('id DESC')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(500), nullable=False)
@@ -23,6 +65,7 @@ class Task(db.Model):
     due_time = db.Column(db.Time)
     status = db.Column(db.String(50), default='scheduled')
     source_email_id = db.Column(db.String(200))  # IMAP message ID
+    subject_key = db.Column(db.String(500), index=True)  # Thread key, kept in sync with title
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -30,6 +73,14 @@ class Task(db.Model):
     subtasks = db.relationship('Subtask', backref='task', lazy=True, cascade='all, delete-orphan',
                                order_by='Subtask.sort_order')
 
+    # Message-IDs of the emails in this task's thread
+    messages = db.relationship('TaskMessage', backref='task', lazy=True, cascade='all, delete-orphan')
+
+    @validates('title')
+    def update_subject_key(self, key, title):
+        self.subject_key = make_subject_key(title)
+        return title
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -57,7 +108,7 @@ class Subtask(db.Model):
     __tablename__ = 'subtasks'
 
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='CASCADE'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='CASCADE'), nullable=False, index=True)
     title = db.Column(db.String(500), nullable=False)
     status = db.Column(db.String(50), default='pending')  # pending/completed
     sort_order = db.Column(db.Integer, default=0)
@@ -84,6 +135,78 @@ class ProcessedEmail(db.Model):
     processed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class TaskMessage(db.Model):
+    """Maps every email Message-ID seen in a thread to its task."""
+    __tablename__ = 'task_messages'
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.String(500), unique=True, nullable=False, index=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MailboxState(db.Model):
+    """Per-mailbox IMAP sync state for incremental (UID-based) scanning."""
+    __tablename__ = 'mailbox_states'
+    __table_args__ = (db.UniqueConstraint('account', 'folder', name='uq_mailbox_state'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    account = db.Column(db.String(200), nullable=False, default='')
+    folder = db.Column(db.String(100), nullable=False)
+    uidvalidity = db.Column(db.BigInteger)
+    last_uid = db.Column(db.BigInteger, default=0)  # Highest UID already scanned
+    # Checkpoint of an unfinished non-incremental scan: the search it ran
+    # (with the UIDVALIDITY) and the highest UID it got through
+    resume_search = db.Column(db.String(200))
+    resume_uid = db.Column(db.BigInteger)
+    # Highest UID any scan's search has returned (with its UIDVALIDITY), to tell new mail from old
+    newest_uid = db.Column(db.BigInteger)
+    newest_uidvalidity = db.Column(db.BigInteger)
+    # JSON {uid: failed scans} of the emails the checkpoint is held back by
+    failed_attempts = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def get_or_create(account, folder):
+        state = MailboxState.query.filter_by(account=account, folder=folder).first()
+        if not state:
+            state = MailboxState(account=account, folder=folder, last_uid=0)
+            db.session.add(state)
+        return state
+
+
+class CachedMessage(db.Model):
+    """Compressed local copy of a fetched email, so rescans need not download it again."""
+    __tablename__ = 'message_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.String(500), unique=True, nullable=False)
+    # Where it was last seen, for reclassification; a message in several
+    # folders is stored once, with a CachedLocation for each folder
+    account = db.Column(db.String(200), nullable=False, default='')
+    folder = db.Column(db.String(100), nullable=False)
+    uidvalidity = db.Column(db.BigInteger)
+    uid = db.Column(db.BigInteger)
+    headers = db.Column(db.LargeBinary)  # zlib-compressed header block, as fetched
+    body = db.Column(db.LargeBinary)  # zlib-compressed decoded text; NULL if never fetched
+    size = db.Column(db.Integer, default=0)  # Compressed bytes, for the size limit
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class CachedLocation(db.Model):
+    """A folder and UID a cached message was seen at, for looking its headers up before the fetch."""
+    __tablename__ = 'message_cache_locations'
+    __table_args__ = (db.UniqueConstraint('account', 'folder', 'uidvalidity', 'uid', name='uq_message_cache_location'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    account = db.Column(db.String(200), nullable=False, default='')
+    folder = db.Column(db.String(100), nullable=False)
+    uidvalidity = db.Column(db.BigInteger, nullable=False)
+    uid = db.Column(db.BigInteger, nullable=False)
+    message_id = db.Column(db.String(500), nullable=False, index=True)
+
+
 class SubtaskTemplate(db.Model):
     """Subtask templates for quick task setup."""
     __tablename__ = 'subtask_templates'
@@ -132,10 +255,10 @@ class EmailScanLog(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     scan_time = db.Column(db.DateTime, default=datetime.utcnow)
-    message_id = db.Column(db.String(500))
+    message_id = db.Column(db.String(500), index=True)
     subject = db.Column(db.String(500))
     from_address = db.Column(db.String(200))
-    result = db.Column(db.String(50))  # created, skipped_marketing, skipped_no_trigger, skipped_duplicate
+    result = db.Column(db.String(50))  # created, skipped_marketing, skipped_no_trigger, skipped_duplicate, skipped_failed
     reason = db.Column(db.String(200))
     task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='SET NULL'), nullable=True)
 
@@ -150,3 +273,63 @@ class EmailScanLog(db.Model):
             'reason': self.reason,
             'task_id': self.task_id
         }
+
+
+class ScanJob(db.Model):
+    """A scan or reclassification started from the API, polled by the client for progress."""
+    __tablename__ = 'scan_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), default='scan')  # scan/reclassify
+    status = db.Column(db.String(20), default='queued', index=True)  # queued/running/completed/failed
+    params = db.Column(db.Text)  # JSON job arguments
+    holder = db.Column(db.String(200))  # Scheduler lease holder running the job
+    total = db.Column(db.Integer, default=0)  # Emails found by the searches so far
+    fetched = db.Column(db.Integer, default=0)
+    classified = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    created = db.Column(db.Integer, default=0)
+    result = db.Column(db.Text)  # JSON scan result once finished
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def eta_seconds(self):
+        """Estimate the remaining time from the rate emails have been processed at."""
+        if self.status != 'running' or not self.started_at or not self.processed:
+            return None
+        elapsed = (datetime.utcnow() - self.started_at).total_seconds()
+        remaining = max(0, (self.total or 0) - self.processed)
+        return round(elapsed / self.processed * remaining, 1)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind or 'scan',
+            'status': self.status,
+            'params': json.loads(self.params) if self.params else {},
+            'progress': {
+                'total': self.total or 0,
+                'fetched': self.fetched or 0,
+                'classified': self.classified or 0,
+                'processed': self.processed or 0,
+                'created': self.created or 0,
+            },
+            'eta_seconds': self.eta_seconds(),
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class SchedulerLease(db.Model):
+    """Time-limited lease electing the one process that runs background scans."""
+    __tablename__ = 'scheduler_leases'
+
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(200))  # host:pid:nonce of the process holding it
+    expires_at = db.Column(db.DateTime)
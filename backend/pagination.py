@@ -0,0 +1,70 @@
+import base64
+import json
+from datetime import date, datetime
+
+from models import db, Task
+
+# Upper bound for the limit parameter of paginated task lists
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(task):
+    """Opaque cursor pointing just after the given task in board order."""
+    key = [
+        task.due_date.isoformat() if task.due_date else None,
+        task.created_at.isoformat() if task.created_at else None,
+        task.id,
+    ]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (due_date, created_at, id) from a cursor. Raises ValueError if it is malformed."""
+    try:
+        due_date, created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (date.fromisoformat(due_date) if due_date else None,
+                datetime.fromisoformat(created_at) if created_at else None,
+                int(task_id))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {e}')
+
+
+def after_in_segment(created_at, task_id):
+    """Tasks after (created_at, id) among those sharing a due date, ordered created_at desc, id desc."""
+    if created_at is None:
+        return db.and_(Task.created_at.is_(None), Task.id < task_id)
+    return db.or_(
+        Task.created_at < created_at,
+        db.and_(Task.created_at == created_at, Task.id < task_id),
+        Task.created_at.is_(None)
+    )
+
+
+def paginate_tasks(query, limit, cursor=None):
+    """Return (tasks, next_cursor) for one page of a task query in board order.
+
+    Board order is due_date asc with undated tasks last, then created_at
+    desc, with id desc as tie-breaker. Tasks with and without a due date
+    are read as two consecutive ranges of ix_tasks_board_order, so a page
+    costs the same however deep it is. next_cursor is None on the last page.
+    """
+    due_date, created_at, task_id = decode_cursor(cursor) if cursor else (None, None, None)
+    order = (Task.created_at.desc(), Task.id.desc())
+    tasks = []
+
+    if cursor is None or due_date is not None:
+        dated = query.filter(Task.due_date.isnot(None))
+        if cursor:
+            # The range starts at the cursor's due date; skip what that date already returned
+            dated = dated.filter(Task.due_date >= due_date, db.or_(
+                Task.due_date > due_date, after_in_segment(created_at, task_id)))
+        tasks = dated.order_by(Task.due_date.asc(), *order).limit(limit + 1).all()
+
+    if len(tasks) <= limit:
+        undated = query.filter(Task.due_date.is_(None))
+        if cursor and due_date is None:
+            undated = undated.filter(after_in_segment(created_at, task_id))
+        tasks += undated.order_by(*order).limit(limit + 1 - len(tasks)).all()
+
+    next_cursor = encode_cursor(tasks[limit - 1]) if len(tasks) > limit else None
+    return tasks[:limit], next_cursor
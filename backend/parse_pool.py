@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from models import Setting
+from config import Config
+from mail_parser import body_from_payload
+
+logger = logging.getLogger(__name__)
+
+# Per-process matcher state, set once by init_worker
+_worker = {}
+
+
+def analyze_message(job, classifier, extractor):
+    """Decode and classify one message body. Runs in the parent or a pool worker.
+
+    job is (uid, payload, subject, from_header, from_email); returns
+    (uid, analysis) where analysis is a small dict, or carries 'error' if
+    the message could not be processed.
+    """
+    uid, payload, subject, from_header, from_email = job
+    try:
+        body = body_from_payload(payload)
+        marketing_word, category, trigger_word, priority = classifier.classify(subject, body, from_header)
+        ref_numbers = {}
+        if category and not marketing_word:
+            ref_numbers = extractor.extract(subject, body, from_email)
+    except Exception as e:
+        return uid, {'error': f'{type(e).__name__}: {e}'}
+
+    return uid, {
+        'body': body,  # Already capped by BODY_FETCH_MAX_BYTES; kept whole for the message cache
+        'marketing_word': marketing_word,
+        'category': category,
+        'trigger_word': trigger_word,
+        'priority': priority,
+        'ref_numbers': ref_numbers,
+    }
+
+
+def init_worker(classifier, extractor):
+    _worker['classifier'] = classifier
+    _worker['extractor'] = extractor
+
+
+def _analyze_in_worker(job):
+    return analyze_message(job, _worker['classifier'], _worker['extractor'])
+
+
+class ParsePool:
+    """Process pool that decodes and classifies message bodies off the scanning thread.
+
+    Workers never touch the database; they get raw payloads and return
+    small result records, and the scan writes everything itself.
+    """
+
+    def __init__(self, workers, classifier, extractor):
+        self.workers = workers
+        self.classifier = classifier
+        self.extractor = extractor
+        # fork: a spawned worker would re-import the app module and start another scheduler
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=init_worker,
+            initargs=(classifier, extractor)
+        )
+
+    @staticmethod
+    def create(message_count, classifier, extractor):
+        """Start a pool when a scan is large enough to benefit, else return None."""
+        workers = int(Setting.get('parse_pool_workers') or Config.PARSE_POOL_WORKERS) or os.cpu_count() or 1
+        min_messages = int(Setting.get('parse_pool_min_messages') or Config.PARSE_POOL_MIN_MESSAGES)
+        if workers < 2 or message_count < min_messages:
+            return None
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            logger.info("Process pool parsing needs the fork start method, parsing serially")
+            return None
+
+        logger.info(f"Parsing {message_count} messages with {workers} worker processes")
+        return ParsePool(workers, classifier, extractor)
+
+    def map(self, jobs):
+        """Analyze jobs in the pool, returning (uid, analysis) pairs in order."""
+        try:
+            chunksize = max(1, len(jobs) // (self.workers * 4))
+            return list(self.executor.map(_analyze_in_worker, jobs, chunksize=chunksize))
+        except Exception as e:
+            # A crashed worker breaks the whole pool; finish this batch here
+            logger.error(f"Parse pool failed ({e}), parsing batch serially")
+            return [analyze_message(job, self.classifier, self.extractor) for job in jobs]
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,163 @@
+import logging
+import zlib
+from collections import Counter
+
+from models import db, CachedMessage, EmailScanLog, normalize_subject, make_subject_key
+from classifier import get_classifier
+from references import get_reference_extractor
+from email_service import EmailService
+from scan_pipeline import ScanPipeline, ScanItem
+
+logger = logging.getLogger(__name__)
+
+# Cached emails examined per query
+CHUNK_SIZE = 500
+
+# Changed decisions listed in the report
+MAX_REPORTED = 200
+
+# Scan outcomes that new trigger words or filters can change
+SKIPPED_RESULTS = ('skipped_no_trigger', 'skipped_marketing')
+
+
+def previous_results(message_ids):
+    """Return {message_id: result} of the latest scan log entry of each email."""
+    rows = db.session.query(EmailScanLog.message_id, EmailScanLog.result).filter(
+        EmailScanLog.message_id.in_(message_ids)
+    ).order_by(EmailScanLog.scan_time, EmailScanLog.id)
+    return dict(rows)
+
+
+def candidate_rows(after_id):
+    """Cached emails whose last scan outcome was a skip, so they never became or joined a task.
+
+    Later duplicate skips don't count, they only mean the email was seen
+    again. Emails whose task was deleted stay excluded, their outcome was
+    'created'.
+    """
+    latest = db.select(EmailScanLog.result).where(
+        EmailScanLog.message_id == CachedMessage.message_id,
+        EmailScanLog.result != 'skipped_duplicate'
+    ).order_by(EmailScanLog.id.desc()).limit(1).correlate(CachedMessage).scalar_subquery()
+    return CachedMessage.query.filter(
+        CachedMessage.id > after_id,
+        latest.in_(SKIPPED_RESULTS)
+    ).order_by(CachedMessage.id).limit(CHUNK_SIZE).all()
+
+
+def reclassify_cached(app, apply=False, progress=None):
+    """Run the current trigger words and marketing filters over already captured emails.
+
+    Emails that were skipped (no trigger word, marketing) and are still in
+    the message cache go through the scan pipeline's screen, classify and
+    thread_match stages again without touching IMAP. The report lists the
+    emails whose outcome changed; with apply set, the ones that now qualify
+    become tasks (or join an existing task's thread) just as in a scan.
+    progress is the JobProgress of the job running it, if any.
+    """
+    service = EmailService(app)
+    classifier = get_classifier()
+    extractor = get_reference_extractor()
+    pipelines = {}
+    results = Counter()
+    changed = []
+    created_task_ids = []
+    errors = []
+    # Subjects of emails that would become tasks, for threading in a dry run
+    new_threads = {}
+
+    after_id = 0
+    while True:
+        rows = candidate_rows(after_id)
+        if not rows:
+            break
+        after_id = rows[-1].id
+        previous = previous_results([row.message_id for row in rows])
+        if progress:
+            progress.add(total=len(rows), fetched=len(rows))
+
+        by_folder = {}
+        for row in rows:
+            item = ScanItem(row.uid, zlib.decompress(row.headers))
+            if row.body is not None:
+                item.payload = ('text', zlib.decompress(row.body).decode('utf-8'))
+            by_folder.setdefault(row.folder, []).append(item)
+        db.session.commit()
+
+        for folder, batch in by_folder.items():
+            pipeline = pipelines.get(folder)
+            if pipeline is None:
+                pipeline = pipelines[folder] = ScanPipeline(service, classifier, extractor, folder=folder)
+                # Marketing emails were marked processed without a task
+                pipeline.replace_processed = True
+                # Failures are retried by the next run, not given up on as in a scan
+                pipeline.max_attempts = 0
+
+            batch = next(pipeline.screen(pipeline.parse([batch])))
+            for item in batch:
+                if not item.done and item.payload is None:
+                    # Only the headers were ever fetched
+                    item.decide('no_content', 'Body not cached')
+            batch = next(pipeline.classify([batch]))
+            pipeline.stats['thread_match'].run(batch, pipeline.thread_match)
+
+            for item in batch:
+                if item.result is None and not item.failed and not apply:
+                    key = make_subject_key(item.subject)
+                    if len(normalize_subject(item.subject)) > 5 and key in new_threads:
+                        item.decide('skipped_thread', f'Thread of reclassified email {new_threads[key]}')
+                    else:
+                        new_threads[key] = item.message_id
+
+            if apply:
+                created_before = len(pipeline.writer.created_task_ids)
+                to_write = [item for item in batch
+                            if not item.failed and item.result in (None, 'skipped_thread')]
+                if to_write:
+                    pipeline.persist([to_write])
+                    pipeline.writer.commit()
+                created_task_ids.extend(pipeline.writer.created_task_ids[created_before:])
+
+            for item in batch:
+                if item.failed:
+                    results['failed'] += 1
+                    if item.error:
+                        errors.append(item.error)
+                    continue
+                result = item.result or 'created'
+                results[result] += 1
+                if result != previous.get(item.message_id) and len(changed) < MAX_REPORTED:
+                    analysis = item.analysis if item.analysis and 'error' not in item.analysis else {}
+                    changed.append({
+                        'message_id': item.message_id,
+                        'subject': item.subject,
+                        'from_address': item.from_email,
+                        'folder': folder,
+                        'previous_result': previous.get(item.message_id),
+                        'result': result,
+                        'reason': item.reason,
+                        'category': analysis.get('category'),
+                        'trigger_word': analysis.get('trigger_word'),
+                        'priority': analysis.get('priority'),
+                    })
+
+            if progress:
+                created = sum(1 for item in batch if not item.failed and item.result is None)
+                progress.add(classified=len(batch), processed=len(batch), created=created)
+                progress.flush()
+                db.session.commit()
+
+    examined = sum(results.values())
+    would = 'Created' if apply else 'Would create'
+    logger.info(f"Reclassified {examined} cached emails: {dict(results)}")
+    return {
+        'success': True,
+        'applied': apply,
+        'examined': examined,
+        'results': dict(results),
+        'tasks_created': len(created_task_ids) if apply else results['created'],
+        'created_task_ids': created_task_ids,
+        'changed': changed,
+        'errors': errors or None,
+        'message': f"Reclassified {examined} emails. {would} {results['created']} tasks."
+    }
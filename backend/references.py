@@ -0,0 +1,111 @@
+import json
+import logging
+import re
+import threading
+
+from models import Setting
+
+logger = logging.getLogger(__name__)
+
+# Reference number following a label, e.g. "PO# 4500-12A" or "Quote: 981"
+NUMBER = r'[#:\s-]*(?P<number>\d+[-\w]*)'
+
+# Built-in patterns, one alternative per field. Labels must start at a word
+# boundary ("also 3" is not an SO). The bare SO and Q labels are
+# uppercase-only since "so"/"q" are common in ordinary text, and a bare Q
+# needs a separator or at least three digits so "Q1" or "Q3 results" don't
+# match. "PO Box" addresses are not purchase orders.
+DEFAULT_PATTERNS = {
+    'po_number': r'(?i:PO(?!\s*Box)|P\.O\.|Purchase\s+Order)',
+    'so_number': r'(?:SO|(?i:Sales\s+Order))',
+    'quote_number': r'(?:(?i:Quote|RFQ)|Q(?=\s*[#:-]|\d{3}))',
+}
+
+# Every built-in label starts with one of these letters
+LABEL_START = r'(?=[PpSsQqRr])'
+
+
+class ReferenceExtractor:
+    """Find PO, SO and quote numbers in a single scan of the text.
+
+    Every field's label is an alternative of one precompiled regex, so the
+    text is scanned once and the first occurrence of each field wins.
+    Customer patterns, keyed by sender domain, are full regexes with one
+    capture group and are tried before the built-in ones.
+    """
+
+    def __init__(self, customer_patterns=None):
+        self.fields = list(DEFAULT_PATTERNS)
+        # The leading lookahead on the labels' first letters lets the regex
+        # engine skip ahead to candidate positions instead of testing the
+        # word boundary everywhere
+        self.pattern = re.compile(
+            LABEL_START + r'(?<!\w)(?:' +
+            '|'.join(f'(?P<{field}>{label})' for field, label in DEFAULT_PATTERNS.items()) + ')' + NUMBER
+        )
+
+        self.customer_patterns = {}
+        for domain, fields in (customer_patterns or {}).items():
+            compiled = {}
+            for field, patterns in fields.items():
+                if isinstance(patterns, str):
+                    patterns = [patterns]
+                try:
+                    compiled[field] = [re.compile(p, re.IGNORECASE) for p in patterns]
+                except re.error as e:
+                    logger.warning(f"Ignoring invalid reference pattern for {domain} {field}: {e}")
+            self.customer_patterns[domain.lower().lstrip('@')] = compiled
+
+    def _customer_fields(self, from_email):
+        if not self.customer_patterns or not from_email or '@' not in from_email:
+            return {}
+        domain = from_email.rsplit('@', 1)[1].lower()
+        # Fall back to parent domains so "acme.com" covers "mail.acme.com"
+        while domain:
+            if domain in self.customer_patterns:
+                return self.customer_patterns[domain]
+            domain = domain.partition('.')[2]
+        return {}
+
+    def extract(self, subject, body, from_email=None):
+        """Return a dict with whichever of po_number, so_number and quote_number were found."""
+        text = f"{subject} {body}"
+        result = {}
+
+        for field, patterns in self._customer_fields(from_email).items():
+            for pattern in patterns:
+                match = pattern.search(text)
+                if match:
+                    result[field] = match.group(1) if pattern.groups else match.group()
+                    break
+
+        wanted = len(self.fields) - sum(1 for f in self.fields if f in result)
+        if wanted:
+            for match in self.pattern.finditer(text):
+                field = next(f for f in self.fields if match.group(f) is not None)
+                if field not in result:
+                    result[field] = match.group('number')
+                    wanted -= 1
+                    if not wanted:
+                        break
+
+        return result
+
+
+_cache = {'raw': None, 'extractor': ReferenceExtractor()}
+_cache_lock = threading.Lock()
+
+
+def get_reference_extractor():
+    """Get the extractor, recompiling it when the reference_patterns setting changes."""
+    raw = Setting.get('reference_patterns')
+    with _cache_lock:
+        if raw != _cache['raw']:
+            try:
+                customer_patterns = json.loads(raw) if raw else {}
+            except ValueError:
+                logger.warning("reference_patterns setting is not valid JSON, using built-in patterns")
+                customer_patterns = {}
+            _cache['extractor'] = ReferenceExtractor(customer_patterns)
+            _cache['raw'] = raw
+        return _cache['extractor']
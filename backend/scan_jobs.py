@@ -0,0 +1,228 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from models import db, ScanJob
+from email_service import scan_mailboxes
+from reclassify import reclassify_cached
+import scheduler
+from leader import lease_holder
+from scheduler import scan_lock, is_leader
+
+logger = logging.getLogger(__name__)
+
+# A queued or running job not updated for this long was lost, e.g. to a restart
+STALE_AFTER = timedelta(minutes=30)
+
+# Finished jobs kept around for polling
+KEEP_FINISHED = 50
+
+# Minimum seconds between progress writes to the job row
+PROGRESS_INTERVAL = 1.0
+
+# Makes the check for a running job and the insert of a new one atomic
+_submit_lock = threading.Lock()
+
+# Thread running this process's queued jobs, see dispatch_scan_jobs
+_runner = None
+_wakeup = threading.Event()
+
+
+class JobProgress:
+    """Progress of one scan job, summed over the pipelines of all its mailboxes.
+
+    Pipelines add their counts after every batch and then call flush()
+    inside their write phase, so the job row is updated in the same
+    transaction as the batch, at most once per PROGRESS_INTERVAL.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.last_write = 0.0
+
+    def add(self, **counts):
+        with self.lock:
+            self.counts.update(counts)
+
+    def flush(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_write < PROGRESS_INTERVAL:
+                return
+            self.last_write = now
+            values = dict(self.counts)
+        if values:
+            ScanJob.query.filter_by(id=self.job_id).update(values)
+
+
+def expire_stale_jobs():
+    """Fail jobs whose runner went away without finishing them.
+
+    A running job is lost as soon as the process that claimed it no longer
+    holds the scheduler lease, e.g. after it died and another process took
+    over; any other job once it has not been updated for STALE_AFTER.
+    """
+    cutoff = datetime.utcnow() - STALE_AFTER
+    orphaned = db.and_(ScanJob.status == 'running', ScanJob.holder.isnot(None))
+    holder = lease_holder()
+    if holder:
+        orphaned = db.and_(orphaned, ScanJob.holder != holder)
+    stale = ScanJob.query.filter(
+        ScanJob.status.in_(('queued', 'running')),
+        db.or_(ScanJob.updated_at < cutoff, orphaned)
+    ).all()
+    for job in stale:
+        logger.warning(f"Scan job {job.id} lost its runner, marking it failed")
+        job.status = 'failed'
+        job.error = 'Scan job was interrupted'
+        job.finished_at = datetime.utcnow()
+
+
+def prune_finished_jobs():
+    keep = db.session.query(ScanJob.id).order_by(ScanJob.id.desc()).limit(KEEP_FINISHED)
+    ScanJob.query.filter(
+        ScanJob.status.in_(('completed', 'failed')),
+        ScanJob.id.notin_(keep.scalar_subquery())
+    ).delete(synchronize_session=False)
+
+
+def submit_job(app, kind, args, same_args=False):
+    """Queue a job and return (job, coalesced).
+
+    While a job of the same kind (and with same_args, the same arguments)
+    is queued or running, further requests get that job back instead of
+    starting a second one. Jobs are run by the scheduler leader; if that is
+    this process it starts right away, otherwise the leader's scan_jobs
+    poll picks it up within SCAN_JOB_POLL_SECONDS.
+    """
+    params = json.dumps(args, sort_keys=True)
+    with _submit_lock:
+        expire_stale_jobs()
+        active = ScanJob.query.filter(ScanJob.kind == kind, ScanJob.status.in_(('queued', 'running')))
+        if same_args:
+            active = active.filter(ScanJob.params == params)
+        job = active.order_by(ScanJob.id).first()
+        coalesced = job is not None
+        if not coalesced:
+            prune_finished_jobs()
+            job = ScanJob(kind=kind, status='queued', params=params)
+            db.session.add(job)
+        db.session.commit()
+
+    if not coalesced and is_leader():
+        dispatch_scan_jobs(app)
+    return job, coalesced
+
+
+def submit_scan_job(app, **scan_args):
+    """Queue a scan of the configured mailboxes, see submit_job."""
+    return submit_job(app, 'scan', scan_args)
+
+
+def submit_reclassify_job(app, apply=False):
+    """Queue a reclassification of the cached skipped emails, see submit_job."""
+    return submit_job(app, 'reclassify', {'apply': bool(apply)}, same_args=True)
+
+
+def dispatch_scan_jobs(app):
+    """Start running queued jobs in this process, unless it already is."""
+    global _runner
+    with _submit_lock:
+        _wakeup.set()
+        if _runner:
+            return
+        _runner = threading.Thread(target=run_queued_jobs, args=(app,), name='scan-jobs', daemon=True)
+        _runner.start()
+
+
+def claim_next_job():
+    """Mark the oldest queued job running and return it, or None if there is none.
+
+    The conditional update keeps two processes from claiming the same job.
+    The job records the lease holder, so that a leader taking over can tell
+    the job was lost with its previous runner.
+    """
+    if scheduler.leader and not scheduler.leader.is_leader:
+        # Lost the lease; the new leader runs the rest
+        return None
+    expire_stale_jobs()
+    job = ScanJob.query.filter_by(status='queued').order_by(ScanJob.id).first()
+    if job is None:
+        db.session.commit()
+        return None
+    claimed = ScanJob.query.filter_by(id=job.id, status='queued').update(
+        {'status': 'running', 'started_at': datetime.utcnow(),
+         'holder': scheduler.leader.holder if scheduler.leader else None}, synchronize_session=False)
+    db.session.commit()
+    return ScanJob.query.get(job.id) if claimed else None
+
+
+def run_queued_jobs(app):
+    """Run queued jobs one after another until none are left."""
+    global _runner
+    try:
+        while True:
+            _wakeup.clear()
+            # Waits here while a scheduled or IDLE scan is running
+            with scan_lock, app.app_context():
+                job = claim_next_job()
+                if job is not None:
+                    run = run_reclassify_job if job.kind == 'reclassify' else run_scan_job
+                    run(app, job.id, json.loads(job.params or '{}'))
+                    continue
+
+            with _submit_lock:
+                # A job queued after the claim above would otherwise wait for the next dispatch
+                if not _wakeup.is_set():
+                    _runner = None
+                    return
+    except Exception as e:
+        logger.error(f"Scan job runner failed: {e}")
+        with _submit_lock:
+            _runner = None
+
+
+def run_scan_job(app, job_id, scan_args):
+    """Run a claimed scan, recording its progress and result on the job row."""
+    progress = JobProgress(job_id)
+    result = None
+    error = None
+    try:
+        result = scan_mailboxes(app, progress=progress, **scan_args)
+        if not result.get('success'):
+            error = result.get('message')
+    except Exception as e:
+        logger.error(f"Scan job {job_id} failed: {e}")
+        db.session.rollback()
+        error = str(e)
+    finish_job(job_id, progress, result, error)
+
+
+def run_reclassify_job(app, job_id, args):
+    """Run a claimed reclassification; already holds scan_lock, so apply can't race a scan."""
+    progress = JobProgress(job_id)
+    result = None
+    error = None
+    try:
+        result = reclassify_cached(app, apply=args.get('apply', False), progress=progress)
+    except Exception as e:
+        logger.error(f"Reclassify job {job_id} failed: {e}")
+        db.session.rollback()
+        error = str(e)
+    finish_job(job_id, progress, result, error)
+
+
+def finish_job(job_id, progress, result, error):
+    progress.flush(force=True)
+    job = ScanJob.query.get(job_id)
+    job.status = 'failed' if error else 'completed'
+    job.result = json.dumps(result) if result is not None else None
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f"Scan job {job_id} ({job.kind}) {job.status}")
@@ -0,0 +1,637 @@
+import email
+from email.utils import parseaddr, parsedate_to_datetime
+from datetime import datetime, timedelta
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import threading
+
+from models import db, Task, ProcessedEmail, Setting, EmailScanLog, normalize_subject, make_subject_key
+from config import Config
+from parse_pool import analyze_message
+
+logger = logging.getLogger(__name__)
+
+# Serializes the write phase of concurrent mailbox scans. SQLite has a single
+# writer, and two deferred transactions both upgrading to write would fail.
+SQLITE_WRITE_LOCK = threading.Lock()
+
+# Stages in the order an email passes through them
+STAGES = ('fetch', 'parse', 'dedup', 'screen', 'fetch_body', 'classify', 'thread_match', 'persist')
+
+
+class ScanWriter:
+    """Groups the database writes of a scan into batched commits.
+
+    Each email is written inside its own SAVEPOINT so a failing email is
+    rolled back alone, while the surrounding transaction is only committed
+    every SCAN_COMMIT_EVERY emails or SCAN_COMMIT_INTERVAL_MS milliseconds.
+    """
+
+    def __init__(self, commit_every=None, commit_interval_ms=None):
+        self.commit_every = commit_every or int(Setting.get('scan_commit_every') or Config.SCAN_COMMIT_EVERY)
+        self.commit_interval_ms = commit_interval_ms or int(
+            Setting.get('scan_commit_interval_ms') or Config.SCAN_COMMIT_INTERVAL_MS)
+        self.commits = 0
+        self.lock_wait_ms = 0.0  # Time spent flushing/committing, including waits on the write lock
+        self.created_task_ids = []
+        self.failed_uids = []
+        self.errors = []
+        self.pending_uids = []
+        self.pending_task_ids = []
+        self.last_commit = time.monotonic()
+
+    @contextmanager
+    def message(self, uid):
+        """Run one email's writes in a savepoint, committing the batch when due."""
+        savepoint = db.session.begin_nested()
+        try:
+            yield
+            started = time.monotonic()
+            savepoint.commit()
+            self.lock_wait_ms += (time.monotonic() - started) * 1000
+        except Exception:
+            if savepoint.is_active:
+                savepoint.rollback()
+            raise
+
+        self.pending_uids.append(uid)
+        elapsed_ms = (time.monotonic() - self.last_commit) * 1000
+        if len(self.pending_uids) >= self.commit_every or elapsed_ms >= self.commit_interval_ms:
+            self.commit()
+
+    def task_created(self, task_id):
+        """Record a task created by the current email; counted once committed."""
+        self.pending_task_ids.append(task_id)
+
+    def commit(self):
+        """Commit everything written since the last commit."""
+        if self.pending_uids or self.pending_task_ids:
+            started = time.monotonic()
+            try:
+                db.session.commit()
+                self.commits += 1
+                self.created_task_ids.extend(self.pending_task_ids)
+            except Exception as e:
+                logger.error(f"Failed to commit {len(self.pending_uids)} scanned emails: {e}")
+                db.session.rollback()
+                self.errors.append(str(e))
+                self.failed_uids.extend(self.pending_uids)
+            self.lock_wait_ms += (time.monotonic() - started) * 1000
+
+        self.pending_uids = []
+        self.pending_task_ids = []
+        self.last_commit = time.monotonic()
+
+
+class StageStats:
+    """Counters and cumulative wall/CPU time of one pipeline stage.
+
+    CPU time is that of the scanning thread; work done in ParsePool
+    workers only shows up as wall time of the classify stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0   # Emails the stage had to decide on
+        self.passed = 0  # Emails it handed on still undecided
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    @contextmanager
+    def timed(self):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.wall += time.perf_counter() - wall
+            self.cpu += time.thread_time() - cpu
+
+    def run(self, items, handle):
+        """Apply handle to every undecided item, counting and timing it."""
+        with self.timed():
+            for item in items:
+                if item.done:
+                    continue
+                self.items += 1
+                try:
+                    handle(item)
+                except Exception as e:
+                    item.fail(e)
+                if not item.done:
+                    self.passed += 1
+
+    def as_dict(self):
+        return {
+            'items': self.items,
+            'passed': self.passed,
+            'wall_ms': round(self.wall * 1000, 1),
+            'cpu_ms': round(self.cpu * 1000, 1),
+        }
+
+
+class ScanItem:
+    """One email on its way through the pipeline.
+
+    A stage that settles the email's fate sets result (and reason); later
+    stages then only carry it along to persist.
+    """
+
+    __slots__ = ('uid', 'raw_headers', 'msg', 'message_id', 'subject', 'from_header', 'from_email',
+                 'payload', 'analysis', 'result', 'reason', 'task_id', 'failed', 'error')
+
+    def __init__(self, uid, raw_headers=None):
+        self.uid = uid
+        self.raw_headers = raw_headers
+        self.msg = None
+        self.message_id = ''
+        self.subject = ''
+        self.from_header = ''
+        self.from_email = ''
+        self.payload = None
+        self.analysis = None
+        self.result = None
+        self.reason = None
+        self.task_id = None
+        self.failed = False
+        self.error = None
+
+    @property
+    def done(self):
+        return self.failed or self.result is not None
+
+    def decide(self, result, reason=None, task_id=None):
+        self.result = result
+        self.reason = reason
+        self.task_id = task_id
+
+    def fail(self, error=None):
+        self.failed = True
+        self.error = str(error) if error is not None else None
+
+
+class ScanPipeline:
+    """A scan of one folder as a chain of generator stages.
+
+    fetch -> parse -> dedup -> screen -> fetch_body -> classify run on
+    batches of FETCH_BATCH_SIZE emails; persist then runs thread_match and
+    the writes one email at a time, so a reply can match a thread created
+    by an earlier email of the same batch. Everything runs lazily on the
+    calling thread, so only one batch is held in memory and all database
+    writes go through a single ScanWriter.
+
+    Transactions are ended before every IMAP round-trip, so a read lock is
+    never held while waiting on the network. With concurrent set (other
+    mailboxes are scanned at the same time) persist also re-checks
+    processed_emails, and on SQLite takes SQLITE_WRITE_LOCK for each batch.
+
+    A progress object (see scan_jobs.JobProgress) is told the counts of
+    every persisted batch, and the checkpoint callback, if set, is called
+    in the same transaction with the UID the folder's next scan can resume
+    after. An email failing for the max_attempts-th scan in a row, counted
+    in attempts, is logged as skipped_failed instead so the checkpoint can
+    move past it. No new batch is fetched once the SCAN_TIME_BUDGET_SECONDS or
+    SCAN_MESSAGE_BUDGET of the scan is used up; remaining then says how
+    many emails were left for the next scan.
+
+    With a MessageCache set, fetch and fetch_body only go to IMAP for the
+    emails not in it, and persist stores every batch in it.
+    """
+
+    def __init__(self, service, classifier, extractor, pool=None, folder='INBOX', batch_size=None,
+                 concurrent=False, progress=None):
+        self.service = service
+        self.classifier = classifier
+        self.extractor = extractor
+        self.pool = pool
+        self.folder = folder
+        self.batch_size = batch_size or service.get_fetch_batch_size()
+        self.max_bytes = service.get_body_fetch_max_bytes()
+        self.concurrent = concurrent
+        self.progress = progress
+        self.reported = Counter()
+        self.checkpoint = None
+        self.persisted_uid = 0
+        self.cache = None
+        # Set by reclassification, whose emails may already be marked processed
+        self.replace_processed = False
+        self.time_budget = int(Setting.get('scan_time_budget_seconds') or Config.SCAN_TIME_BUDGET_SECONDS)
+        self.message_budget = int(Setting.get('scan_message_budget') or Config.SCAN_MESSAGE_BUDGET)
+        self.deadline = None
+        self.remaining = 0
+        self.write_lock = SQLITE_WRITE_LOCK if concurrent and db.engine.dialect.name == 'sqlite' else nullcontext()
+        self.writer = ScanWriter()
+        self.stats = {name: StageStats(name) for name in STAGES}
+        self.counts = Counter()
+        self.known_ids = set()
+        self.failed_uids = []
+        self.attempts = {}  # Failed scans per UID, including earlier scans'
+        self.max_attempts = int(Setting.get('scan_max_attempts') or Config.SCAN_MAX_ATTEMPTS)
+        self.errors = []
+        self.log_duplicates = (Setting.get('log_skipped_duplicates') or
+                               str(Config.LOG_SKIPPED_DUPLICATES)).lower() == 'true'
+        self.due_days = int(Setting.get('default_due_days') or Config.DEFAULT_DUE_DAYS)
+
+    def run(self, uids):
+        """Scan the given UIDs, then commit whatever is still pending."""
+        if self.progress:
+            self.progress.add(total=len(uids))
+        if self.time_budget:
+            self.deadline = time.monotonic() + self.time_budget
+        batches = self.fetch(uids)
+        batches = self.parse(batches)
+        batches = self.dedup(batches)
+        batches = self.screen(batches)
+        batches = self.fetch_body(batches)
+        batches = self.classify(batches)
+        self.release()
+        self.persist(batches)
+
+        self.writer.commit()
+        self.failed_uids.extend(self.writer.failed_uids)
+        self.errors.extend(self.writer.errors)
+
+        logger.info("Scan stages: " + ', '.join(
+            f"{s.name} {s.items} in {s.wall * 1000:.0f} ms ({s.cpu * 1000:.0f} ms CPU)" for s in self.stats.values()))
+
+    def release(self):
+        """Commit pending writes and end the transaction before going back to IMAP."""
+        self.writer.commit()
+        db.session.commit()
+
+    @contextmanager
+    def write_phase(self):
+        """Hold the write lock for a group of writes, committing them on the way out.
+
+        The current transaction is ended before waiting for the lock, since
+        an open read transaction on SQLite would block the holder's commit.
+        """
+        self.release()
+        with self.write_lock:
+            yield
+            self.release()
+
+    def report_progress(self):
+        """Pass the counts since the last report on to the progress object."""
+        counts = Counter(
+            fetched=self.stats['fetch'].items,
+            classified=self.stats['classify'].items,
+            processed=self.stats['persist'].items,
+            created=len(self.writer.created_task_ids) + len(self.writer.pending_task_ids)
+        )
+        self.progress.add(**(counts - self.reported))
+        self.reported = counts
+        self.progress.flush()
+
+    @property
+    def checkpoint_uid(self):
+        """Highest UID up to which every email has been persisted."""
+        failed = self.failed_uids + self.writer.failed_uids
+        return min(failed) - 1 if failed else self.persisted_uid
+
+    def stage_report(self):
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    # ============== STAGES ==============
+
+    def fetch(self, uids):
+        """Download the headers needed for dedup and filtering, one FETCH per batch."""
+        stats = self.stats['fetch']
+        start = 0
+        while start < len(uids):
+            size = self.batch_size
+            if self.message_budget:
+                size = min(size, self.message_budget - start)
+            if size <= 0 or (self.deadline and time.monotonic() >= self.deadline):
+                self.remaining = len(uids) - start
+                logger.info(f"Scan budget used up in {self.folder}, {self.remaining} emails left for the next scan")
+                return
+
+            batch = []
+            with stats.timed():
+                chunk = uids[start:start + size]
+                if self.cache:
+                    cached = self.cache.headers(chunk)
+                    self.release()
+                    self.counts['cached_headers'] += len(cached)
+                    batch.extend(ScanItem(uid, header_bytes) for uid, header_bytes in cached.items())
+                    chunk = [uid for uid in chunk if uid not in cached]
+                    stats.items += len(cached)
+                    stats.passed += len(cached)
+
+                for uid, header_bytes in self.service.fetch_headers(chunk, self.batch_size):
+                    item = ScanItem(uid, header_bytes)
+                    stats.items += 1
+                    if header_bytes is None:
+                        item.fail()
+                    else:
+                        stats.passed += 1
+                    batch.append(item)
+                # In UID order, so replies come after the emails they answer
+                batch.sort(key=lambda item: item.uid)
+            start += size
+            yield batch
+
+    def parse(self, batches):
+        """Parse and decode the header block of each email."""
+        def handle(item):
+            self.counts['scanned'] += 1
+            item.msg = email.message_from_bytes(item.raw_headers)
+            item.message_id = item.msg.get('Message-ID', '')
+            item.subject = self.service.decode_email_header(item.msg.get('Subject', ''))
+            item.from_header = self.service.decode_email_header(item.msg.get('From', ''))
+            _, item.from_email = parseaddr(item.from_header)
+
+        for batch in batches:
+            self.stats['parse'].run(batch, handle)
+            yield batch
+
+    def dedup(self, batches):
+        """Drop emails already processed, resolving each batch with one query."""
+        def handle(item):
+            if item.message_id in self.known_ids:
+                item.decide('skipped_duplicate', 'Already processed')
+            else:
+                # Also catches a second copy of the same email later in this scan
+                self.known_ids.add(item.message_id)
+
+        stats = self.stats['dedup']
+        for batch in batches:
+            with stats.timed():
+                self.known_ids |= self.service.find_processed_ids(item.message_id for item in batch if not item.done)
+                self.release()
+            stats.run(batch, handle)
+            yield batch
+
+    def screen(self, batches):
+        """Settle what the headers alone can: bulk mail and replies to known threads."""
+        def handle(item):
+            marketing_reason = self.service.is_marketing_header(item.msg, item.subject, item.from_header,
+                                                                self.classifier)
+            if marketing_reason:
+                item.decide('skipped_marketing', marketing_reason)
+                return
+
+            task_id = self.service.find_thread_by_headers(item.msg)
+            if task_id:
+                item.decide('skipped_thread', f'Thread exists: Task #{task_id} (In-Reply-To/References)', task_id)
+
+        for batch in batches:
+            self.stats['screen'].run(batch, handle)
+            with self.stats['screen'].timed():
+                self.release()
+            yield batch
+
+    def fetch_body(self, batches):
+        """Download the text part of the emails still undecided."""
+        stats = self.stats['fetch_body']
+        for batch in batches:
+            with stats.timed():
+                pending = {item.uid: item for item in batch if not item.done}
+                stats.items += len(pending)
+                if self.cache and pending:
+                    bodies = self.cache.bodies(item.message_id for item in pending.values())
+                    self.release()
+                    for uid, item in list(pending.items()):
+                        if item.message_id in bodies:
+                            item.payload = ('text', bodies[item.message_id])
+                            stats.passed += 1
+                            self.counts['cached_bodies'] += 1
+                            del pending[uid]
+
+                for uid, payload in self.service.fetch_body_payloads(list(pending), self.batch_size,
+                                                                     self.max_bytes):
+                    item = pending.get(uid)
+                    if item is None:
+                        continue
+                    if payload is None:
+                        item.fail()
+                    else:
+                        item.payload = payload
+                        stats.passed += 1
+                # Expunged in the meantime: nothing to scan
+                for item in pending.values():
+                    if item.payload is None and not item.failed:
+                        item.decide('vanished')
+            yield batch
+
+    def classify(self, batches):
+        """Decode bodies, classify and extract references, in the ParsePool when there is one.
+
+        The verdict is applied by thread_match, since a reply to a known
+        thread is linked to it whatever its content.
+        """
+        def handle(item):
+            item.payload = None
+            if 'error' in item.analysis:
+                item.fail(item.analysis['error'])
+
+        stats = self.stats['classify']
+        for batch in batches:
+            with stats.timed():
+                jobs = [(item.uid, item.payload, item.subject, item.from_header, item.from_email)
+                        for item in batch if not item.done]
+                if self.pool and jobs:
+                    results = dict(self.pool.map(jobs))
+                else:
+                    results = dict(analyze_message(job, self.classifier, self.extractor) for job in jobs)
+                for item in batch:
+                    item.analysis = results.get(item.uid, item.analysis)
+            stats.run(batch, handle)
+            yield batch
+
+    def thread_match(self, item):
+        """Attach an email to an existing task by headers or normalized subject.
+
+        Emails that are neither replies nor marketing and carry a trigger
+        word pass on to become new tasks.
+        """
+        # The thread may have been created earlier in this batch
+        task_id = self.service.find_thread_by_headers(item.msg)
+        if task_id:
+            item.decide('skipped_thread', f'Thread exists: Task #{task_id} (In-Reply-To/References)', task_id)
+            return
+
+        analysis = item.analysis
+        if analysis['marketing_word']:
+            item.decide('skipped_marketing', f'Marketing filter: "{analysis["marketing_word"]}"')
+            return
+        if not analysis['category']:
+            item.decide('skipped_no_trigger', 'No trigger words found')
+            return
+
+        # Match any task with the same base subject, regardless of sender
+        normalized_subj = normalize_subject(item.subject)
+        if normalized_subj and len(normalized_subj) > 5:  # Only check if subject is meaningful
+            existing_task = Task.query.filter(
+                Task.subject_key == make_subject_key(item.subject)
+            ).order_by(Task.id).first()
+            if existing_task:
+                item.decide('skipped_thread', f'Thread exists: Task #{existing_task.id}', existing_task.id)
+
+    def persist(self, batches):
+        """Thread-match and write each email of a batch in its own savepoint."""
+        stats = self.stats['persist']
+        for batch in batches:
+            with self.write_phase():
+                if self.concurrent:
+                    self.recheck_processed(batch)
+
+                for item in batch:
+                    self.stats['thread_match'].run((item,), self.thread_match)
+
+                    with stats.timed():
+                        stats.items += 1
+                        if not item.failed:
+                            try:
+                                with self.writer.message(item.uid):
+                                    self.write(item)
+                            except Exception as e:
+                                item.fail(e)
+
+                        if item.failed:
+                            if item.error:
+                                logger.error(f"Error processing email {item.uid}: {item.error}")
+                                self.errors.append(item.error)
+                            if not self.give_up(item):
+                                self.failed_uids.append(item.uid)
+                        else:
+                            stats.passed += 1
+
+                if self.cache:
+                    self.save_to_cache(batch)
+                if batch:
+                    self.persisted_uid = max(self.persisted_uid, max(item.uid for item in batch))
+                if self.checkpoint:
+                    self.checkpoint(self.checkpoint_uid)
+                if self.progress:
+                    self.report_progress()
+
+    def give_up(self, item):
+        """Count a failed attempt at an email; past max_attempts, log it as skipped and return True."""
+        attempts = self.attempts[item.uid] = self.attempts.get(item.uid, 0) + 1
+        if not self.max_attempts or attempts < self.max_attempts:
+            return False
+        logger.error(f"Giving up on email {item.uid} in {self.folder} after {attempts} failed scans")
+        self.counts['skipped_failed'] += 1
+        try:
+            with self.writer.message(item.uid):
+                self.log(item, 'skipped_failed', f'Failed {attempts} times: {item.error}'[:200])
+        except Exception as e:
+            logger.warning(f"Could not log skipped email {item.uid}: {e}")
+        return True
+
+    def save_to_cache(self, batch):
+        """Store a batch in the message cache; a failure only costs a later refetch."""
+        with self.stats['persist'].timed():
+            savepoint = db.session.begin_nested()
+            try:
+                self.cache.save(batch)
+                savepoint.commit()
+            except Exception as e:
+                if savepoint.is_active:
+                    savepoint.rollback()
+                logger.warning(f"Could not cache scanned emails: {e}")
+
+    def recheck_processed(self, batch):
+        """Drop emails another mailbox's scan processed since this batch was deduped."""
+        with self.stats['persist'].timed():
+            pending = [item for item in batch if not item.done]
+            processed = self.service.find_processed_ids(item.message_id for item in pending)
+            for item in pending:
+                if item.message_id in processed:
+                    item.decide('skipped_duplicate', 'Already processed')
+
+    # ============== WRITES ==============
+
+    def log(self, item, result, reason, task_id=None):
+        db.session.add(EmailScanLog(
+            message_id=item.message_id,
+            subject=item.subject[:500] if item.subject else '',
+            from_address=item.from_email,
+            result=result,
+            reason=reason,
+            task_id=task_id
+        ))
+
+    def write(self, item):
+        if item.result == 'vanished':
+            return
+
+        if self.replace_processed:
+            # In the email's savepoint, so the mark stays if the new writes fail
+            ProcessedEmail.query.filter_by(message_id=item.message_id).delete(synchronize_session=False)
+
+        if item.result == 'skipped_duplicate':
+            self.counts['skipped_duplicate'] += 1
+            if self.log_duplicates:
+                self.log(item, item.result, item.reason)
+
+        elif item.result == 'skipped_marketing':
+            self.counts['skipped_marketing'] += 1
+            # Mark as processed but don't create task
+            db.session.add(ProcessedEmail(message_id=item.message_id, folder=self.folder))
+            self.log(item, item.result, item.reason)
+
+        elif item.result == 'skipped_thread':
+            self.counts['skipped_duplicate'] += 1
+            # Mark as processed but don't create new task
+            db.session.add(ProcessedEmail(message_id=item.message_id, folder=self.folder))
+            self.service.record_thread_message(item.message_id, item.task_id)
+            self.log(item, item.result, item.reason)
+
+        elif item.result == 'skipped_no_trigger':
+            self.counts['skipped_no_trigger'] += 1
+            # Log it but don't mark as processed (might match future trigger words)
+            self.log(item, item.result, item.reason)
+
+        else:
+            self.create_task(item)
+
+    def create_task(self, item):
+        analysis = item.analysis
+        body = analysis['body']
+        ref_numbers = analysis['ref_numbers']
+        customer_info = self.service.extract_customer_info(item.from_header, body)
+
+        # Get email date and calculate due date based on it
+        email_date = None
+        try:
+            date_header = item.msg.get('Date')
+            if date_header:
+                email_date = parsedate_to_datetime(date_header)
+        except Exception:
+            pass
+
+        # Use email date + due_days, or fallback to today + due_days
+        if email_date:
+            due_date = (email_date + timedelta(days=self.due_days)).date()
+        else:
+            due_date = datetime.now().date() + timedelta(days=self.due_days)
+
+        task = Task(
+            title=item.subject[:500] if item.subject else f"Email from {customer_info['name']}",
+            description=body[:5000] if body else '',
+            customer_name=customer_info['name'],
+            customer_email=customer_info['email'],
+            company=customer_info['company'],
+            po_number=ref_numbers.get('po_number'),
+            so_number=ref_numbers.get('so_number'),
+            quote_number=ref_numbers.get('quote_number'),
+            priority=analysis['priority'],
+            due_date=due_date,
+            status='scheduled',
+            source_email_id=item.message_id
+        )
+
+        db.session.add(task)
+        db.session.flush()  # Get the task ID
+
+        # Mark email as processed
+        db.session.add(ProcessedEmail(message_id=item.message_id, folder=self.folder))
+        self.service.record_thread_message(item.message_id, task.id)
+        self.log(item, 'created', f'Trigger: "{analysis["trigger_word"]}" ({analysis["category"]})', task.id)
+
+        self.writer.task_created(task.id)
+        logger.info(f"Created task: {task.title[:50]}...")
@@ -0,0 +1,34 @@
+"""Standalone email scanner, run from backend/ with `python -m scanner`.
+
+Runs the scan scheduler, the IMAP IDLE worker and queued scan-now jobs in
+a process of its own, against the same database as the web app. Start the
+web app with SCHEDULER_ENABLED=false so slow IMAP servers and Telegram
+calls no longer share its workers.
+"""
+import logging
+import signal
+import threading
+
+from app import app
+from scheduler import init_scheduler, scheduler, shutdown
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    # Importing app already started the scheduler unless SCHEDULER_ENABLED is off
+    init_scheduler(app)
+    logger.info("Scanner running, press Ctrl+C to stop")
+
+    stop.wait()
+    logger.info("Scanner stopping")
+    scheduler.shutdown()
+    shutdown(app)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,51 @@
+import atexit
 import logging
+import threading
+from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 from models import Setting
 from config import Config
+from leader import LeaderLease
 
 logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
+# Held for the duration of every scan started by this process
+scan_lock = threading.Lock()
 
-def scan_emails_job(app):
-    """Job function to scan emails."""
-    from email_service import email_service
+# Push-mode worker, run by the leader when IMAP IDLE is enabled
+idle_worker = None
+
+# How often the leader looks for scan jobs queued by other processes
+SCAN_JOB_POLL_SECONDS = 3
+
+# Lease deciding which process runs scans, when several share the database
+# (e.g. gunicorn workers). Set by init_scheduler.
+leader = None
 
-    with app.app_context():
-        logger.info("Running scheduled email scan...")
-        # Scan past 1 day regardless of read status
-        result = email_service.scan_inbox(days=1)
+
+def run_scan(app, service=None, **scan_args):
+    """Run one incremental scan and notify about new tasks.
+
+    Without a service every configured mailbox is scanned; the IDLE worker
+    passes its own session. Scans from the interval job and the IDLE worker
+    are serialized so they never race on the high-water mark or
+    processed_emails inserts.
+    """
+    from email_service import scan_mailboxes
+
+    # Only fetch new UIDs; falls back to the past 1 day regardless of read status
+    scan_args.setdefault('days', 1)
+    scan_args.setdefault('incremental', Config.INCREMENTAL_SCAN)
+
+    with scan_lock, app.app_context():
+        if service:
+            result = service.scan_inbox(**scan_args)
+        else:
+            result = scan_mailboxes(app, **scan_args)
 
         if result['tasks_created'] > 0:
             logger.info(f"Created {result['tasks_created']} new tasks from emails")
@@ -26,19 +54,131 @@ def scan_emails_job(app):
             from telegram_service import telegram_service
             if telegram_service.is_configured():
                 from models import Task
-                # Get recently created tasks (last 5 minutes)
-                from datetime import datetime, timedelta
-                recent = datetime.utcnow() - timedelta(minutes=5)
-                new_tasks = Task.query.filter(Task.created_at >= recent).all()
+                new_tasks = Task.query.filter(Task.id.in_(result['created_task_ids'])).all()
                 for task in new_tasks:
                     telegram_service.notify_new_task(task)
 
+    return result
+
+
+def is_leader():
+    """Whether this process runs background scans."""
+    return leader is not None and leader.is_leader
+
+
+def is_adaptive():
+    return (Setting.get('scan_interval_adaptive') or str(Config.SCAN_INTERVAL_ADAPTIVE)).lower() == 'true'
+
+
+def interval_bounds():
+    low = float(Setting.get('scan_interval_min_minutes') or Config.SCAN_INTERVAL_MIN_MINUTES)
+    high = float(Setting.get('scan_interval_max_minutes') or Config.SCAN_INTERVAL_MAX_MINUTES)
+    return low, high
+
+
+def effective_interval():
+    """Minutes between scheduled scans.
+
+    The configured interval, or in adaptive mode the one the scans have
+    settled on, which is kept in settings so a new leader carries on with it.
+    """
+    configured = int(Setting.get('scan_interval_minutes') or Config.SCAN_INTERVAL_MINUTES)
+    if not is_adaptive():
+        return configured
+    low, high = interval_bounds()
+    current = float(Setting.get('scan_interval_effective_minutes') or configured)
+    return min(high, max(low, current))
+
+
+def adapt_scan_interval(app, result):
+    """Halve the interval after a scan that found new mail, double it after an empty or failed one."""
+    with app.app_context():
+        if not is_adaptive():
+            return
+        current = effective_interval()
+        # Emails with a UID above any the previous scans had seen. Dedup passes would also
+        # count old emails skipped for lacking a trigger word, which every full scan sees again
+        new_mail = bool(result and result.get('success') and result.get('new_messages'))
+        low, high = interval_bounds()
+        interval = max(low, current / 2) if new_mail else min(high, current * 2)
+        if interval != current:
+            Setting.set('scan_interval_effective_minutes', f'{interval:g}')
+            update_scan_interval(interval)
+
+
+def reset_scan_interval():
+    """Start over from the configured interval after the settings changed."""
+    Setting.set('scan_interval_effective_minutes', '')
+    update_scan_interval(effective_interval())
+
+
+def scan_emails_job(app):
+    """Job function to scan emails."""
+    if not is_leader():
+        return
+    logger.info("Running scheduled email scan...")
+    result = None
+    try:
+        result = run_scan(app)
+    except Exception as e:
+        logger.error(f"Scheduled email scan failed: {e}")
+    adapt_scan_interval(app, result)
+
+
+def leadership_job(app):
+    """Renew the scheduler lease, starting or stopping the leader's workers."""
+    global idle_worker
+    was_leader = is_leader()
+    leader.renew()
+
+    if is_leader() and not was_leader:
+        with app.app_context():
+            idle_enabled = (Setting.get('imap_idle_enabled') or str(Config.IMAP_IDLE_ENABLED)).lower() == 'true'
+        if idle_enabled:
+            from idle_worker import IdleWorker
+            idle_worker = IdleWorker(app)
+            idle_worker.start()
+    elif was_leader and not is_leader() and idle_worker:
+        idle_worker.stop()
+        idle_worker = None
+
+    if is_leader():
+        # The interval may have been changed through another process's API
+        with app.app_context():
+            interval = effective_interval()
+        if scheduler.get_job('email_scan').trigger.interval.total_seconds() != interval * 60:
+            update_scan_interval(interval)
+
+
+def scan_jobs_job(app):
+    """Run scan-now jobs queued by any process, e.g. the web workers."""
+    if is_leader():
+        from scan_jobs import dispatch_scan_jobs
+        dispatch_scan_jobs(app)
+
+
+def shutdown(app):
+    if idle_worker:
+        idle_worker.stop()
+    leader.release()
+
 
 def init_scheduler(app):
-    """Initialize the scheduler with email scanning job."""
+    """Initialize the scheduler with email scanning job.
+
+    Every process starts the scheduler, but only the holder of the
+    scheduler lease runs the scans, so web workers can be scaled without
+    duplicating scan work. If the leader dies, another process takes over
+    within SCHEDULER_LEASE_SECONDS.
+    """
+    global leader
+    if scheduler.running:
+        return
+    leader = LeaderLease(app)
+
     # Get interval from settings or config
     with app.app_context():
-        interval = int(Setting.get('scan_interval_minutes') or Config.SCAN_INTERVAL_MINUTES)
+        interval = effective_interval()
 
     # Add the email scanning job
     scheduler.add_job(
@@ -49,12 +189,35 @@ def init_scheduler(app):
         replace_existing=True
     )
 
+    # Renew well before the lease lapses. Push mode's IDLE worker is started
+    # here, with the interval job as fallback.
+    scheduler.add_job(
+        func=lambda: leadership_job(app),
+        trigger=IntervalTrigger(seconds=max(1, Config.SCHEDULER_LEASE_SECONDS // 3)),
+        id='scheduler_lease',
+        name='Renew scheduler lease',
+        next_run_time=datetime.now(),
+        replace_existing=True
+    )
+
+    scheduler.add_job(
+        func=lambda: scan_jobs_job(app),
+        trigger=IntervalTrigger(seconds=SCAN_JOB_POLL_SECONDS),
+        id='scan_jobs',
+        name='Run queued scan jobs',
+        replace_existing=True
+    )
+
     scheduler.start()
+    atexit.register(shutdown, app)
     logger.info(f"Scheduler started. Email scan interval: {interval} minutes")
 
 
 def update_scan_interval(minutes):
     """Update the email scan interval."""
+    if not scheduler.running:
+        # Scans run in the scanner process, which picks the new setting up itself
+        return
     scheduler.reschedule_job(
         'email_scan',
         trigger=IntervalTrigger(minutes=minutes)
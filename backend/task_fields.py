@@ -0,0 +1,56 @@
+from models import db, Task, Subtask
+
+# Fields of the compact representation used by the board and list views
+SUMMARY_FIELDS = ['id', 'title', 'customer_name', 'company', 'priority', 'status', 'due_date', 'due_time',
+                  'subtasks_done', 'subtasks_total']
+
+# Columns the list order and pagination cursor need, whether requested or not
+ORDER_FIELDS = ['id', 'due_date', 'created_at']
+
+
+def subtask_counts():
+    """Correlated subqueries counting the completed and all subtasks of a task."""
+    done = db.select(db.func.count(Subtask.id)).where(
+        Subtask.task_id == Task.id, Subtask.status == 'completed'
+    ).correlate(Task).scalar_subquery()
+    total = db.select(db.func.count(Subtask.id)).where(
+        Subtask.task_id == Task.id
+    ).correlate(Task).scalar_subquery()
+    return {'subtasks_done': done, 'subtasks_total': total}
+
+
+def parse_fields(value):
+    """Turn a fields= parameter into a list of field names.
+
+    Accepts a comma-separated list of Task columns plus subtasks_done and
+    subtasks_total; "summary" stands for SUMMARY_FIELDS. Raises ValueError
+    naming any unknown field.
+    """
+    fields = []
+    for name in (part.strip() for part in value.split(',')):
+        for field in (SUMMARY_FIELDS if name == 'summary' else [name] if name else []):
+            if field not in fields:
+                fields.append(field)
+
+    known = set(Task.__table__.columns.keys()) | set(subtask_counts())
+    unknown = [field for field in fields if field not in known]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def select_fields(query, fields):
+    """Restrict a task query to the given fields, computing subtask counts in SQL."""
+    counts = subtask_counts()
+    columns = [counts[field].label(field) if field in counts else getattr(Task, field)
+               for field in dict.fromkeys(fields + ORDER_FIELDS)]
+    return query.with_entities(*columns)
+
+
+def fields_dict(row, fields):
+    """Serialize a row of select_fields() the way Task.to_dict() would."""
+    data = {}
+    for field in fields:
+        value = getattr(row, field)
+        data[field] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return data
@@ -0,0 +1,129 @@
+import logging
+import re
+
+from sqlalchemy import column, table
+from sqlalchemy.exc import OperationalError
+
+from models import db, Task
+
+logger = logging.getLogger(__name__)
+
+# Searchable task columns and their weight in the SQLite ranking
+SEARCH_COLUMNS = [
+    ('title', 10.0),
+    ('po_number', 8.0),
+    ('so_number', 8.0),
+    ('customer_name', 5.0),
+    ('company', 5.0),
+    ('description', 1.0),
+]
+
+# Postgres ranks by weight class instead: A for title and order numbers, B for customer, D for description
+POSTGRES_VECTOR = """
+    setweight(to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(po_number, '') || ' '
+                          || coalesce(so_number, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(customer_name, '') || ' ' || coalesce(company, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'D')
+"""
+
+tasks_fts = table('tasks_fts', column('rowid'), column('rank'), column('tasks_fts'))
+
+# 'fts5', 'tsvector' or 'ilike', detected once per process
+_backend = None
+
+
+def init_search_index():
+    """Create the full-text index of tasks where the database supports one, inside init_db."""
+    global _backend
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        _backend = 'fts5' if init_fts5() else 'ilike'
+    elif dialect == 'postgresql':
+        init_tsvector()
+        _backend = 'tsvector'
+    else:
+        _backend = 'ilike'
+    return _backend
+
+
+def init_fts5():
+    """SQLite: an FTS5 table over the tasks table, kept in sync by triggers."""
+    names = [name for name, weight in SEARCH_COLUMNS]
+    exists = db.session.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'")).first()
+    if not exists:
+        try:
+            db.session.execute(db.text(
+                f"CREATE VIRTUAL TABLE tasks_fts USING fts5({', '.join(names)}, content='tasks', "
+                f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"))
+        except OperationalError as e:
+            db.session.rollback()
+            logger.warning(f"SQLite has no FTS5, task search falls back to LIKE: {e}")
+            return False
+        weights = ', '.join(str(weight) for name, weight in SEARCH_COLUMNS)
+        db.session.execute(db.text(f"INSERT INTO tasks_fts (tasks_fts, rank) VALUES ('rank', 'bm25({weights})')"))
+
+    new_values = ', '.join(f'new.{name}' for name in names)
+    old_values = ', '.join(f'old.{name}' for name in names)
+    insert = f"INSERT INTO tasks_fts (rowid, {', '.join(names)}) VALUES (new.id, {new_values});"
+    delete = f"INSERT INTO tasks_fts (tasks_fts, rowid, {', '.join(names)}) VALUES ('delete', old.id, {old_values});"
+    db.session.execute(db.text(
+        f"CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN {insert} END"))
+    db.session.execute(db.text(
+        f"CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN {delete} END"))
+    db.session.execute(db.text(
+        f"CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF id, {', '.join(names)} ON tasks "
+        f"BEGIN {delete} {insert} END"))
+
+    if not exists:
+        # Index the tasks created before the index existed
+        db.session.execute(db.text("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')"))
+        logger.info("Built the task search index")
+    db.session.commit()
+    return True
+
+
+def init_tsvector():
+    """Postgres: a generated tsvector column with a GIN index."""
+    db.session.execute(db.text(
+        f"ALTER TABLE tasks ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({POSTGRES_VECTOR}) STORED"))
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_tasks_search_vector ON tasks USING GIN (search_vector)'))
+    db.session.commit()
+
+
+def search_backend():
+    if _backend is None:
+        return init_search_index()
+    return _backend
+
+
+def search_tasks(query, text):
+    """Restrict a task query to tasks matching the search text.
+
+    Every word of the text must match the start of a word in the title,
+    customer, company, PO or SO number or description. Returns the query
+    and a rank expression to order by, best match first, or None when the
+    database has no full-text index and the search falls back to substring
+    matching.
+    """
+    terms = re.findall(r'\w+', text.lower())
+    backend = search_backend()
+
+    if terms and backend == 'fts5':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        hits = db.select(tasks_fts.c.rowid.label('task_id'), tasks_fts.c.rank.label('rank')).where(
+            tasks_fts.c.tasks_fts.op('MATCH')(match)
+        ).subquery()
+        return query.join(hits, hits.c.task_id == Task.id), hits.c.rank
+
+    if terms and backend == 'tsvector':
+        tsquery = db.func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        vector = db.literal_column('tasks.search_vector')
+        return query.filter(vector.op('@@')(tsquery)), -db.func.ts_rank(vector, tsquery)
+
+    pattern = f"%{text}%"
+    return query.filter(
+        db.or_(*[getattr(Task, name).ilike(pattern) for name, weight in SEARCH_COLUMNS])
+    ), None
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+# app initializes its database on import, so point it at a scratch one first
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['SCHEDULER_ENABLED'] = 'false'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest  # noqa: E402
+
+from app import app as flask_app  # noqa: E402
+from models import db, SubtaskTemplate  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+        db.session.rollback()
+        # Empty every table but the default template created by init_db
+        for table in reversed(db.metadata.sorted_tables):
+            if table is not SubtaskTemplate.__table__:
+                db.session.execute(table.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
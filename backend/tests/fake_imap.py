@@ -0,0 +1,50 @@
+from email.message import EmailMessage
+
+
+def make_message(uid, subject, body='Please send a quote for 40 widgets.'):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = 'Bob <bob@acme.com>'
+    msg['Message-ID'] = f'<m{uid}@example.com>'
+    msg['Date'] = 'Mon, 12 Oct 2026 10:00:00 -0400'
+    msg.set_content(body)
+    return msg.as_bytes().replace(b'\n', b'\r\n')
+
+
+class FakeIMAP:
+    """Just enough of imaplib.IMAP4 for scan_inbox: one folder, no BODYSTRUCTURE support."""
+
+    def __init__(self, uidvalidity, messages=None):
+        self.uidvalidity = uidvalidity
+        self.messages = dict(messages or {})
+        self.searches = []
+
+    def select(self, mailbox='INBOX', readonly=False):
+        return 'OK', [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, [str(self.uidvalidity).encode()]
+
+    def uid(self, command, *args):
+        if command == 'SEARCH':
+            criteria = args[-1]
+            self.searches.append(criteria)
+            uids = sorted(self.messages)
+            if criteria.startswith('UID '):
+                low = int(criteria[4:].split(':')[0])
+                # "n:*" always matches the highest UID
+                uids = [uid for uid in uids if uid >= low] or uids[-1:]
+            return 'OK', [' '.join(str(uid) for uid in uids).encode()]
+
+        spec, items = args
+        if 'BODYSTRUCTURE' in items:
+            return 'NO', [b'BODYSTRUCTURE not supported']
+        data = []
+        for n, uid in enumerate(int(uid) for uid in spec.split(',')):
+            raw = self.messages.get(uid)
+            if raw is None:
+                continue
+            if 'HEADER' in items:
+                raw = raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+            data += [(f'{n + 1} (UID {uid} BODY[] {{{len(raw)}}}'.encode(), raw), b')']
+        return 'OK', data
@@ -0,0 +1,68 @@
+from models import db, EmailScanLog, MailboxState, Setting
+from email_service import EmailService
+from scan_pipeline import ScanPipeline
+
+from fake_imap import FakeIMAP, make_message
+
+
+def scan(app, connection):
+    service = EmailService(app)
+    service.connection = connection
+    return service.scan_inbox(incremental=True, days=1)
+
+
+def test_uidvalidity_change_with_empty_window_restarts_uids(app):
+    account = EmailService(app).get_config()['email']
+    db.session.add(MailboxState(account=account, folder='INBOX', uidvalidity=7, last_uid=10))
+    db.session.commit()
+
+    # The folder was recreated and nothing is in the search window yet
+    result = scan(app, FakeIMAP(8))
+    assert result['success'] and result['emails_scanned'] == 0
+
+    # New mail starts again at low UIDs
+    connection = FakeIMAP(8, {1: make_message(1, 'Quote request 1'), 2: make_message(2, 'Quote request 2')})
+    result = scan(app, connection)
+
+    assert result['emails_scanned'] == 2
+    assert result['tasks_created'] == 2
+    state = MailboxState.query.filter_by(account=account, folder='INBOX').one()
+    assert (state.uidvalidity, state.last_uid) == (8, 2)
+
+
+def test_incremental_scan_continues_after_last_uid(app):
+    messages = {uid: make_message(uid, f'Quote request {uid}') for uid in (1, 2, 3)}
+    assert scan(app, FakeIMAP(8, messages))['tasks_created'] == 3
+
+    messages[4] = make_message(4, 'Quote request 4')
+    connection = FakeIMAP(8, messages)
+    result = scan(app, connection)
+
+    assert result['mode'] == 'incremental'
+    assert connection.searches == ['UID 4:*']
+    assert result['tasks_created'] == 1
+
+
+def test_email_failing_every_scan_is_given_up_on(app, monkeypatch):
+    Setting.set('scan_max_attempts', '2')
+    create_task = ScanPipeline.create_task
+
+    def create_task_failing_uid_2(pipeline, item):
+        if item.uid == 2:
+            raise RuntimeError('broken email')
+        return create_task(pipeline, item)
+
+    monkeypatch.setattr(ScanPipeline, 'create_task', create_task_failing_uid_2)
+    messages = {uid: make_message(uid, f'Quote request {uid}') for uid in (1, 2, 3)}
+    account = EmailService(app).get_config()['email']
+
+    assert scan(app, FakeIMAP(8, messages))['tasks_created'] == 2
+    state = MailboxState.query.filter_by(account=account, folder='INBOX').one()
+    assert state.last_uid == 1
+
+    result = scan(app, FakeIMAP(8, messages))
+
+    assert result['skipped_failed'] == 1
+    db.session.refresh(state)
+    assert (state.last_uid, state.failed_attempts) == (3, None)
+    assert EmailScanLog.query.filter_by(result='skipped_failed').count() == 1
@@ -0,0 +1,22 @@
+from email_service import EmailService
+
+from fake_imap import FakeIMAP, make_message
+
+
+def rescan(app, folder, messages):
+    service = EmailService(app)
+    service.connection = FakeIMAP(8, messages)
+    return service.scan_inbox(days=1, folder=folder)
+
+
+def test_message_in_two_folders_is_found_from_both(app):
+    message = make_message(1, 'Quote request')
+    inbox = {5: message, 6: make_message(2, 'Hello')}
+    quotes = {40: message}
+
+    for _ in range(2):
+        rescan(app, 'INBOX', inbox)
+        rescan(app, 'Quotes', quotes)
+
+    assert rescan(app, 'INBOX', inbox)['cached_headers'] == 2
+    assert rescan(app, 'Quotes', quotes)['cached_headers'] == 1
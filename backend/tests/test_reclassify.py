@@ -0,0 +1,99 @@
+import json
+import zlib
+from email.message import EmailMessage
+
+from models import db, Task, ProcessedEmail, CachedMessage, EmailScanLog, Setting
+from classifier import invalidate_classifier
+from reclassify import reclassify_cached
+from scan_pipeline import ScanPipeline
+from scan_jobs import run_queued_jobs
+
+
+def cache_email(uid, subject, body, result):
+    """Store an email in the message cache as a past scan left it."""
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = 'Bob <bob@acme.com>'
+    msg['Message-ID'] = f'<m{uid}@example.com>'
+    msg['Date'] = 'Mon, 12 Oct 2026 10:00:00 -0400'
+    msg.set_content(body)
+    headers = msg.as_bytes().split(b'\n\n', 1)[0] + b'\n\n'
+
+    db.session.add(CachedMessage(
+        message_id=msg['Message-ID'], account='me@example.com', folder='INBOX', uidvalidity=1, uid=uid,
+        headers=zlib.compress(headers), body=zlib.compress(body.encode('utf-8'))
+    ))
+    db.session.add(EmailScanLog(message_id=msg['Message-ID'], subject=subject, result=result))
+    db.session.commit()
+    return msg['Message-ID']
+
+
+def set_trigger_words(words):
+    Setting.set('trigger_words', json.dumps({'custom': words}))
+    invalidate_classifier()
+
+
+def test_apply_creates_tasks_for_skipped_emails(app):
+    message_id = cache_email(1, 'Need widgets by Friday', 'Please send 40 widgets.', 'skipped_no_trigger')
+    set_trigger_words(['widgets'])
+
+    report = reclassify_cached(app, apply=True)
+
+    assert report['tasks_created'] == 1
+    assert Task.query.filter_by(source_email_id=message_id).count() == 1
+
+
+def test_apply_does_not_recreate_deleted_tasks(app, client):
+    message_id = cache_email(2, 'Quote for widgets', 'Please quote 40 widgets.', 'created')
+    task = Task(title='Quote for widgets', source_email_id=message_id)
+    db.session.add(task)
+    db.session.add(ProcessedEmail(message_id=message_id, folder='INBOX'))
+    db.session.commit()
+    # Later scans saw it again as a duplicate
+    db.session.add(EmailScanLog(message_id=message_id, result='skipped_duplicate'))
+    db.session.commit()
+    assert client.delete(f'/api/tasks/{task.id}').status_code == 200
+    set_trigger_words(['widgets'])
+
+    report = reclassify_cached(app, apply=True)
+
+    assert report['examined'] == 0
+    assert Task.query.filter_by(source_email_id=message_id).count() == 0
+    assert ProcessedEmail.query.filter_by(message_id=message_id).count() == 1
+
+
+def test_reclassify_endpoint_runs_as_a_job(app, client):
+    cache_email(3, 'Need widgets by Friday', 'Please send 40 widgets.', 'skipped_no_trigger')
+    set_trigger_words(['widgets'])
+
+    response = client.post('/api/email/reclassify', json={'apply': True})
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+    assert response.json['kind'] == 'reclassify'
+    assert client.post('/api/email/reclassify', json={'apply': True}).json['job_id'] == job_id
+
+    # End the test's read transaction, the runner writes from a session of its own
+    db.session.commit()
+    run_queued_jobs(app)
+
+    job = client.get(f'/api/email/scan-jobs/{job_id}').json
+    assert job['status'] == 'completed'
+    assert job['result']['tasks_created'] == 1
+    assert job['progress']['processed'] == 1
+
+
+def test_failed_write_keeps_processed_mark(app, monkeypatch):
+    message_id = cache_email(4, 'Widgets order', 'Please send 40 widgets.', 'skipped_marketing')
+    db.session.add(ProcessedEmail(message_id=message_id, folder='INBOX'))
+    db.session.commit()
+    set_trigger_words(['widgets'])
+
+    def create_task(pipeline, item):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(ScanPipeline, 'create_task', create_task)
+
+    report = reclassify_cached(app, apply=True)
+
+    assert report['results'] == {'failed': 1}
+    assert ProcessedEmail.query.filter_by(message_id=message_id).count() == 1
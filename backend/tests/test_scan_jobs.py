@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+from models import db, ScanJob, SchedulerLease
+from scan_jobs import submit_scan_job
+
+
+def test_running_job_of_lost_lease_holder_fails(app, client):
+    db.session.add(SchedulerLease(name='scan-scheduler', holder='web-2',
+                                  expires_at=datetime.utcnow() + timedelta(minutes=1)))
+    lost = ScanJob(kind='scan', status='running', params='{}', holder='web-1')
+    running = ScanJob(kind='reclassify', status='running', params='{}', holder='web-2')
+    db.session.add_all([lost, running])
+    db.session.commit()
+
+    assert client.get(f'/api/email/scan-jobs/{lost.id}').get_json()['status'] == 'failed'
+    assert client.get(f'/api/email/scan-jobs/{running.id}').get_json()['status'] == 'running'
+
+
+def test_scan_request_does_not_coalesce_into_lost_job(app):
+    lost = ScanJob(kind='scan', status='running', params='{}', holder='web-1')
+    db.session.add(lost)
+    db.session.commit()
+
+    job, coalesced = submit_scan_job(app, scan_all=False, days=None, incremental=False)
+
+    assert not coalesced and job.id != lost.id
+    assert db.session.get(ScanJob, lost.id).status == 'failed'
@@ -0,0 +1,9 @@
+from classifier import get_classifier
+
+
+def test_match_whole_words_setting_rebuilds_classifier(client):
+    client.put('/api/settings', json={'match_whole_words': 'false'})
+    assert get_classifier().whole_words is False
+
+    client.put('/api/settings', json={'match_whole_words': 'true'})
+    assert get_classifier().whole_words is True
@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from models import db, Task, Subtask
+
+
+@contextmanager
+def count_statements():
+    """Collect the SQL statements run inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def create_tasks(n, subtasks=3):
+    today = date.today()
+    for i in range(n):
+        task = Task(title=f'Task {i}', status=('scheduled', 'in_progress', 'completed')[i % 3],
+                    priority=('high', 'low')[i % 2], due_date=today + timedelta(days=i % 5 - 2))
+        task.subtasks = [Subtask(title=f'Step {j}', sort_order=j) for j in range(subtasks)]
+        db.session.add(task)
+    db.session.commit()
+    return Task.query.order_by(Task.id).first().id
+
+
+def statements_for(client, n, request):
+    task_id = create_tasks(n)
+    db.session.commit()
+    with count_statements() as statements:
+        response = request(client, task_id)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize('request_', [
+    lambda client, task_id: client.get('/api/tasks'),
+    lambda client, task_id: client.get('/api/tasks?limit=20'),
+    lambda client, task_id: client.get('/api/tasks?fields=summary'),
+    lambda client, task_id: client.get('/api/stats'),
+    lambda client, task_id: client.post(f'/api/tasks/{task_id}/apply-template', json={}),
+], ids=['list', 'page', 'summary', 'stats', 'apply-template'])
+def test_statement_count_does_not_grow_with_tasks(app, client, request_):
+    few = statements_for(client, 25, request_)
+    Task.query.delete()
+    db.session.commit()
+    many = statements_for(client, 100, request_)
+
+    assert many == few
+
+
+def test_list_loads_subtasks_in_one_query(app, client):
+    create_tasks(30)
+    db.session.commit()
+    with count_statements() as statements:
+        tasks = client.get('/api/tasks').json
+
+    assert len(tasks) == 30
+    assert all(len(task['subtasks']) == 3 for task in tasks)
+    assert sum('FROM subtasks' in statement for statement in statements) == 1
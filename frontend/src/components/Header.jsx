@@ -10,6 +10,7 @@ function Header({
   const { theme, setTheme, themes } = useTheme();
   const [scanning, setScanning] = useState(false);
   const [scanResult, setScanResult] = useState(null);
+  const [scanProgress, setScanProgress] = useState(null);
   const [showDropdown, setShowDropdown] = useState(false);
   const dropdownRef = useRef(null);
 
@@ -34,8 +35,16 @@ function Header({
     setShowDropdown(false);
     setScanning(true);
     setScanResult(null);
+    setScanProgress(null);
     try {
-      const result = await api.scanEmails(options);
+      // The scan runs in the background; poll its job until it finishes
+      let job = await api.scanEmails(options);
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        job = await api.getScanJob(job.id);
+        setScanProgress(job.progress);
+      }
+      const result = job.result || { success: false, message: job.error || 'Scan failed' };
       setScanResult(result);
       if (result.tasks_created > 0) {
         onScanEmails(); // Refresh task list
@@ -44,6 +53,7 @@ function Header({
       setScanResult({ success: false, message: 'Scan failed: ' + err.message });
     } finally {
       setScanning(false);
+      setScanProgress(null);
     }
   };
 
@@ -175,7 +185,9 @@ function Header({
             {scanning ? (
               <>
                 <div className="spinner" style={{ width: 16, height: 16, borderWidth: 2 }} />
-                Scanning...
+                {scanProgress && scanProgress.total > 0
+                  ? `Scanning ${scanProgress.processed}/${scanProgress.total}...`
+                  : 'Scanning...'}
               </>
             ) : (
               <>
@@ -81,6 +81,8 @@ export const api = {
     }
   }),
 
+  getScanJob: (id) => request(`/email/scan-jobs/${id}`),
+
   getEmailStatus: () => request('/email/status'),
 
   getEmailLogs: (limit = 100) => request(`/email/logs?limit=${limit}`),